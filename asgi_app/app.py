@@ -0,0 +1,376 @@
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import MongoClient
+from quart import Quart, Response, request, jsonify as quart_jsonify, abort, session
+from quart.wrappers.response import DataBody
+from redis import StrictRedis
+
+import functools
+import asyncio
+import sys
+import os
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "wsgi_app"))
+
+if os.environ.get("TRADE_API_CONFIG"):
+    CONFIG_PATH = os.environ["TRADE_API_CONFIG"]
+elif sys.platform == 'win32':
+    CONFIG_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..\\cfg\\default.json')
+else:
+    CONFIG_PATH = '/usr/share/www/steam-trade-api/cfg/deploy.json'
+
+from config.config import Configurator
+from servers import DatabaseServers
+from upstream import UpstreamClient
+from inventories import DatabaseInventories
+from locations import DatabaseAssetLocations
+from withdrawals import DatabaseWithdrawals
+from deposits import DatabaseDeposits
+from snapshots import InventorySnapshots
+from inventory_index import parse_inventory_query
+from negotiation import JSON_MIMETYPE, negotiate_mimetype, negotiate_inventory, stream_requested, finish_inventory_response, response_encoding, set_compressed_body, representation_tag, serialize, compress_stream
+from reservations import AssetReservations
+from loads import ServerLoads
+from poller import ServerPoller
+from refresh import InventoryRefreshQueue
+from cache import ActiveTradesCache
+from codec import TokenCodec
+from trades import TradeError, parse_trade_request, prepare_withdrawal, withdrawal_jobs, record_withdrawals, prepare_deposit, deposit_jobs, record_deposits, trade_report_update, deposit_report_updates, update_deposit_reports, withdrawal_report_updates, update_withdrawal_reports
+from deltas import parse_inventory_delta, apply_inventory_delta
+from metrics import TimedDatabase, instrument_redis
+from .async_upstream import AsyncUpstreamClient
+from .async_servers import AsyncDatabaseServers
+from .async_metrics import AsyncMetrics
+
+CONFIG = Configurator(CONFIG_PATH)
+
+metrics = AsyncMetrics(CONFIG.get("METRICS_BUCKETS", None))
+mongodb = TimedDatabase(MongoClient(CONFIG.get("MONGODB_HOST", "localhost:27017"), maxPoolSize=CONFIG.get("ASGI_DATABASE_WORKERS", 32))["tradeapi"], metrics)
+redis = instrument_redis(StrictRedis(host=CONFIG["REDIS_HOST"], port=CONFIG["REDIS_PORT"], db=3, password=CONFIG["REDIS_PASSWORD"]), metrics)
+
+upstream = UpstreamClient(
+    CONFIG.get("UPSTREAM_TIMEOUTS", {}),
+    CONFIG.get("UPSTREAM_RETRIES", 2),
+    CONFIG.get("UPSTREAM_BACKOFF", 0.2),
+    CONFIG.get("UPSTREAM_FAILURE_THRESHOLD", 5),
+    CONFIG.get("UPSTREAM_RESET_TIMEOUT", 30),
+    CONFIG.get("UPSTREAM_POOL_SIZE", 10),
+    metrics
+)
+async_upstream = AsyncUpstreamClient(
+    CONFIG.get("UPSTREAM_TIMEOUTS", {}),
+    CONFIG.get("UPSTREAM_RETRIES", 2),
+    CONFIG.get("UPSTREAM_BACKOFF", 0.2),
+    CONFIG.get("UPSTREAM_FAILURE_THRESHOLD", 5),
+    CONFIG.get("UPSTREAM_RESET_TIMEOUT", 30),
+    CONFIG.get("ASGI_UPSTREAM_CONNECTIONS", 1000),
+    metrics
+)
+
+db_servers = DatabaseServers(mongodb, upstream, CONFIG.get("SERVER_REGISTRY_TTL", 60))
+async_servers = AsyncDatabaseServers(mongodb, async_upstream, CONFIG.get("SERVER_REGISTRY_TTL", 60))
+db_asset_locations = DatabaseAssetLocations(mongodb)
+db_inventories = DatabaseInventories(mongodb, CONFIG.get("INVENTORY_STORAGE_FORMAT", "json"), db_asset_locations)
+db_withdrawals = DatabaseWithdrawals(mongodb, ActiveTradesCache(redis, "active_withdrawals", CONFIG.get("ACTIVE_TRADES_CACHE_TTL", 300)))
+db_deposits = DatabaseDeposits(mongodb, ActiveTradesCache(redis, "active_deposits", CONFIG.get("ACTIVE_TRADES_CACHE_TTL", 300)))
+
+token_codec = TokenCodec(CONFIG["CRYPTO_SALT"], CONFIG.get("TOKEN_CODEC_SIZE", 4096))
+inventory_snapshots = InventorySnapshots(db_inventories, redis, token_codec)
+asset_reservations = AssetReservations(redis, CONFIG.get("RESERVATION_TTL", 320))
+server_loads = ServerLoads(
+    redis,
+    db_servers,
+    CONFIG["ACCESS_TOKEN"],
+    CONFIG.get("SERVER_LOAD_MAX_AGE", 300),
+    CONFIG.get("SERVER_LOAD_HISTORY", 60),
+    CONFIG.get("SERVER_LOAD_ALPHA", 0.3),
+    CONFIG.get("SERVER_STATS_MAX_AGE", 90)
+)
+server_poller = ServerPoller(redis, db_servers, server_loads, CONFIG["ACCESS_TOKEN"], CONFIG.get("SERVER_POLL_INTERVAL", 30), CONFIG.get("SERVER_POLL_WORKERS", 8))
+inventory_refresh_queue = InventoryRefreshQueue(db_servers, db_inventories, inventory_snapshots, CONFIG["ACCESS_TOKEN"], CONFIG.get("INVENTORY_REFRESH_WORKERS", 4))
+
+database_executor = ThreadPoolExecutor(CONFIG.get("ASGI_DATABASE_WORKERS", 32))
+
+
+app = Quart(__name__)
+app.config.update(
+    SECRET_KEY=CONFIG['APP_SECRET']
+)
+
+
+async def run_db(func, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(database_executor, functools.partial(metrics.bound(func), *args, **kwargs))
+
+
+async def iterate_db(iterator):
+    done = object()
+    while True:
+        chunk = await run_db(next, iterator, done)
+        if chunk is done:
+            return
+        yield chunk
+
+
+def jsonify(*args, **kwargs):
+    mimetype = negotiate_mimetype(request.accept_mimetypes)
+    if mimetype == JSON_MIMETYPE:
+        with metrics.span("json", "encode"):
+            return quart_jsonify(*args, **kwargs)
+    with metrics.span("msgpack", "encode"):
+        return Response(serialize(args[0] if args else kwargs, mimetype), mimetype=mimetype)
+
+
+def trade_error(error):
+    if error.payload is not None:
+        return jsonify(**error.payload), error.status
+    return abort(error.status)
+
+
+def logged_in():
+    return session.get("authorized", False)
+
+
+def in_allowed_ips(ip_address):
+    if ip_address in CONFIG.get("ALLOW_IPS", []):
+        return True
+    return False
+
+
+@app.before_serving
+async def before_serving():
+    if CONFIG.get("SERVER_POLLER_ENABLED", True):
+        server_poller.start()
+
+
+@app.after_serving
+async def after_serving():
+    await async_upstream.close()
+    database_executor.shutdown(wait=False)
+
+
+@app.before_request
+async def before_request():
+    metrics.start_request()
+
+    if not in_allowed_ips(request.remote_addr):
+        return abort(404)
+
+    if not logged_in():
+        form = await request.form
+        access_token = session.get("token", None) or request.args.get("token", False) or form.get("token", False)
+        if access_token == CONFIG["ACCESS_TOKEN"]:
+            session["authorized"] = True
+
+
+@app.after_request
+async def after_request(response):
+    timings = metrics.finish_request(request.method, request.url_rule.rule if request.url_rule else "unmatched", response.status_code)
+    if timings and CONFIG.get("SERVER_TIMING", False):
+        response.headers["Server-Timing"] = timings.server_timing()
+    return response
+
+
+@app.after_request
+async def compress_response(response):
+    encoding = response_encoding(response, request.accept_encodings, CONFIG.get("RESPONSE_COMPRESSION", True))
+    if encoding and isinstance(response.response, DataBody):
+        body = await response.get_data()
+        if len(body) >= CONFIG.get("RESPONSE_COMPRESS_MIN_SIZE", 1024):
+            with metrics.span("compress", encoding):
+                set_compressed_body(response, body, encoding)
+    return response
+
+
+@app.route("/trade/inventory/<int:app_id>", methods=["GET"])
+async def trade_inventory(app_id):
+    if logged_in():
+        stream = stream_requested(request.args.get("stream"), CONFIG.get("INVENTORY_STREAMING", False))
+        mimetype, streaming, encoding = negotiate_inventory(request.accept_mimetypes, request.accept_encodings, stream, CONFIG.get("RESPONSE_COMPRESSION", True))
+        representation = representation_tag(mimetype, encoding)
+
+        etag = inventory_snapshots.etag(app_id, await run_db(inventory_snapshots.version, app_id)) + representation
+        if request.if_none_match.contains(etag):
+            response = Response("", status=304)
+        elif streaming:
+            chunks = inventory_snapshots.stream(app_id)
+            response = Response(iterate_db(compress_stream(chunks) if encoding else chunks), status=200, mimetype=mimetype)
+        else:
+            snapshot = await run_db(inventory_snapshots.get, app_id)
+            with metrics.span("encode", "inventory%s" % representation):
+                body = await run_db(snapshot.encoded, mimetype, encoding)
+            response = Response(body, status=200, mimetype=mimetype)
+            etag = snapshot.etag + representation
+        return finish_inventory_response(response, etag, encoding)
+    return abort(401)
+
+
+@app.route("/trade/inventory/<int:app_id>/query", methods=["GET"])
+async def trade_inventory_query(app_id):
+    if logged_in():
+        try:
+            query = parse_inventory_query(request.args, CONFIG.get("INVENTORY_QUERY_MAX_LIMIT", 200))
+        except ValueError:
+            return abort(400)
+
+        inventory_index = await run_db(inventory_snapshots.index, app_id)
+        try:
+            page = await run_db(inventory_index.query, **query)
+        except TypeError:
+            return abort(400)
+        return jsonify(**page), 200
+    return abort(401)
+
+
+@app.route("/trade/withdrawals/<string:steam_id>/active", methods=["GET"])
+async def trade_withdrawals_active(steam_id):
+    if logged_in():
+        withdrawals = await run_db(db_withdrawals.get_steam_id, steam_id)
+        return jsonify(withdrawals=withdrawals), 200
+    return abort(401)
+
+
+@app.route("/trade/deposits/<string:steam_id>/active", methods=["GET"])
+async def trade_deposits_active(steam_id):
+    if logged_in():
+        deposits = await run_db(db_deposits.get_steam_id, steam_id)
+        return jsonify(deposits=deposits), 200
+    return abort(401)
+
+
+@app.route("/trade/withdrawals/<string:steam_id>/add", methods=["POST"])
+async def trade_withdrawals_add(steam_id):
+    if logged_in():
+        form = await request.form
+        with metrics.span("json", "decode"):
+            trade_request = parse_trade_request(form)
+        try:
+            withdrawal = await run_db(prepare_withdrawal, trade_request, db_asset_locations, asset_reservations, token_codec)
+        except TradeError as e:
+            return trade_error(e)
+
+        jobs = await run_db(withdrawal_jobs, steam_id, withdrawal, CONFIG["ACCESS_TOKEN"], async_servers.get)
+        results = await asyncio.gather(*[async_servers.withdraw(*job) for job in jobs])
+        return jsonify(**await run_db(record_withdrawals, steam_id, withdrawal, results, db_withdrawals, asset_reservations)), 200
+    return abort(401)
+
+
+@app.route("/trade/deposits/<string:steam_id>/add", methods=["POST"])
+async def trade_deposits_add(steam_id):
+    if logged_in():
+        form = await request.form
+        with metrics.span("json", "decode"):
+            trade_request = parse_trade_request(form)
+        try:
+            deposit = await run_db(prepare_deposit, trade_request, server_loads, CONFIG.get("DEPOSIT_MAX_ASSETS", 500), CONFIG.get("DEPOSIT_MAX_LOAD", 0.9), CONFIG.get("DEPOSIT_MAX_ASSETS_PER_TRADE", 50))
+            jobs = await run_db(deposit_jobs, steam_id, deposit, CONFIG["ACCESS_TOKEN"], async_servers.get)
+            results = await asyncio.gather(*[async_servers.deposit(*job) for job in jobs])
+            return jsonify(**await run_db(record_deposits, steam_id, deposit, results, db_deposits)), 200
+        except TradeError as e:
+            return trade_error(e)
+    return abort(401)
+
+
+@app.route("/trade/deposits/<string:steam_id>/report", methods=["POST"])
+async def trade_deposits_report(steam_id):
+    if logged_in():
+        form = await request.form
+        fields, data = trade_report_update(form)
+        if await run_db(db_deposits.update_last, steam_id, fields, data, form.get("security_code")):
+            return "OK", 200
+        return abort(404)
+    return abort(401)
+
+
+@app.route("/trade/withdrawals/<string:steam_id>/report", methods=["POST"])
+async def trade_withdrawals_report(steam_id):
+    if logged_in():
+        form = await request.form
+        fields, data = trade_report_update(form)
+        if await run_db(db_withdrawals.update_last, steam_id, form.get("bot"), fields, data):
+            return "OK", 200
+        return abort(404)
+    return abort(401)
+
+
+@app.route("/trade/deposits/report", methods=["POST"])
+async def trade_deposits_report_bulk():
+    if logged_in():
+        form = await request.form
+        try:
+            with metrics.span("json", "decode"):
+                updates = deposit_report_updates(json.loads(form.get("reports")))
+        except (TypeError, ValueError, KeyError):
+            return abort(400)
+        return jsonify(**await run_db(update_deposit_reports, updates, db_deposits)), 200
+    return abort(401)
+
+
+@app.route("/trade/withdrawals/report", methods=["POST"])
+async def trade_withdrawals_report_bulk():
+    if logged_in():
+        form = await request.form
+        try:
+            with metrics.span("json", "decode"):
+                updates = withdrawal_report_updates(json.loads(form.get("reports")))
+        except (TypeError, ValueError, KeyError):
+            return abort(400)
+        return jsonify(**await run_db(update_withdrawal_reports, updates, db_withdrawals)), 200
+    return abort(401)
+
+
+async def report_server():
+    server_host = request.remote_addr
+    if server_host == "127.0.0.1" and CONFIG_PATH.endswith("deploy.json"):
+        server_host = "185.46.10.189"
+    return await run_db(db_servers.get_host, server_host)
+
+
+@app.route("/trade/inventory/<int:app_id>/report", methods=["POST"])
+async def trade_inventory_report(app_id):
+    if logged_in():
+        server = await report_server()
+        app_id = int(app_id)
+        bot_username = (await request.form).get("bot", None)
+
+        if server and bot_username:
+            inventory_refresh_queue.enqueue(server, bot_username, app_id)
+            return "OK", 200
+        return abort(400)
+    return abort(401)
+
+
+@app.route("/trade/inventory/<int:app_id>/delta", methods=["POST"])
+async def trade_inventory_delta(app_id):
+    if logged_in():
+        server = await report_server()
+        app_id = int(app_id)
+        form = await request.form
+        bot_username = form.get("bot", None)
+
+        if not server or not bot_username:
+            return abort(400)
+
+        try:
+            with metrics.span("json", "decode"):
+                delta = parse_inventory_delta(form)
+        except ValueError:
+            return abort(400)
+
+        if await run_db(apply_inventory_delta, server, bot_username, app_id, delta, db_inventories, inventory_snapshots, CONFIG.get("INVENTORY_RECONCILE_INTERVAL", 3600)):
+            inventory_refresh_queue.enqueue(server, bot_username, app_id)
+        return "OK", 200
+    return abort(401)
+
+
+@app.route("/trade/inventory/refresh/status", methods=["GET"])
+async def trade_inventory_refresh_status():
+    if logged_in():
+        return jsonify(inventory_refresh_queue.status()), 200
+    return abort(401)
+
+
+@app.route("/metrics", methods=["GET"])
+async def metrics_export():
+    if logged_in():
+        return Response(metrics.render(), status=200, mimetype="text/plain; version=0.0.4")
+    return abort(401)
@@ -0,0 +1,16 @@
+from metrics import Metrics
+import contextvars
+
+
+class AsyncMetrics(Metrics):
+    def __init__(self, buckets=None, prefix="trade_api"):
+        Metrics.__init__(self, buckets, prefix)
+        self.context = contextvars.ContextVar("request_timings", default=None)
+
+    def current(self):
+        return self.context.get()
+
+    def bind(self, timings):
+        previous = self.context.get()
+        self.context.set(timings)
+        return previous
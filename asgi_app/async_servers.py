@@ -0,0 +1,64 @@
+from .async_upstream import AsyncUpstreamClient, ASYNC_UPSTREAM_ERRORS
+from servers import DatabaseServers
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDatabaseServers(DatabaseServers):
+    def __init__(self, db, upstream=None, cache_ttl=60):
+        DatabaseServers.__init__(self, db, upstream or AsyncUpstreamClient(), cache_ttl)
+
+    async def ping(self, host, port, token):
+        try:
+            response = await self.upstream.get("ping", host, port, "/ping", params={"token": token})
+            if response.status_code == 200:
+                return True
+        except ASYNC_UPSTREAM_ERRORS as e:
+            logger.warning("Ping %s:%s failed: %s", host, port, e)
+        return False
+
+    async def deposit(self, server_id, steam_id, trade_token, assets, report_url, additional, token, db_server=None):
+        if db_server is None:
+            db_server = self.get(server_id)
+        if not db_server:
+            logger.warning("Deposit for %s skipped: unknown server %s", steam_id, server_id)
+            return {"success": False}
+        try:
+            post_data = self.trade_post_data(steam_id, trade_token, assets, report_url, additional, token)
+            response = await self.upstream.post("deposit", db_server["host"], db_server["port"], "/deposit", data=post_data)
+            return self.trade_result(response, "Deposit for %s on server %s" % (steam_id, server_id))
+        except ASYNC_UPSTREAM_ERRORS as e:
+            logger.warning("Deposit for %s on server %s failed: %s", steam_id, server_id, e)
+        return {"success": False}
+
+    async def withdraw(self, server_id, steam_id, trade_token, assets, bot, report_url, additional, token, db_server=None):
+        if db_server is None:
+            db_server = self.get(server_id)
+        if not db_server:
+            logger.warning("Withdrawal for %s skipped: unknown server %s", steam_id, server_id)
+            return {"success": False}
+        try:
+            post_data = self.trade_post_data(steam_id, trade_token, assets, report_url, additional, token)
+            response = await self.upstream.post("withdraw", db_server["host"], db_server["port"], "/%s/withdraw" % str(bot), data=post_data)
+            return self.trade_result(response, "Withdrawal for %s from %s on server %s" % (steam_id, bot, server_id))
+        except ASYNC_UPSTREAM_ERRORS as e:
+            logger.warning("Withdrawal for %s from %s on server %s failed: %s", steam_id, bot, server_id, e)
+        return {"success": False}
+
+    async def fetch_server_stats(self, host, port, token):
+        try:
+            response = await self.upstream.get("stats", host, port, "/stats", params={"token": token})
+            return self.stats_result(response)
+        except ASYNC_UPSTREAM_ERRORS as e:
+            logger.warning("Fetching stats from %s:%s failed: %s", host, port, e)
+        return {"success": False}
+
+    async def request_inventory(self, host, port, bot_username, app_id, token):
+        try:
+            response = await self.upstream.get("inventory", host, port, "/bots/%s/inventory/%s" % (bot_username, app_id), params={"token": token})
+            return self.inventory_result(response)
+        except ASYNC_UPSTREAM_ERRORS as e:
+            logger.warning("Fetching %s inventory of %s from %s:%s failed: %s", app_id, bot_username, host, port, e)
+        return {"success": False}
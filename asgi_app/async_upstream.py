@@ -0,0 +1,85 @@
+from upstream import UpstreamClient, CircuitOpenError, UPSTREAM_ERRORS
+import asyncio
+import logging
+import json
+
+import aiohttp
+
+
+logger = logging.getLogger(__name__)
+
+ASYNC_UPSTREAM_ERRORS = UPSTREAM_ERRORS + (aiohttp.ClientError, asyncio.TimeoutError)
+
+
+class UpstreamResponse():
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content.decode("utf-8"))
+
+
+class AsyncUpstreamClient(UpstreamClient):
+    def __init__(self, timeouts=None, retries=2, backoff=0.2, failure_threshold=5, reset_timeout=30, connections=1000, metrics=None):
+        UpstreamClient.__init__(self, timeouts, retries, backoff, failure_threshold, reset_timeout, metrics=metrics)
+        self.connections = int(connections)
+        self.client_session = None
+
+    async def get(self, operation, host, port, path, params=None):
+        return await self.request(operation, "GET", host, port, path, params=params)
+
+    async def post(self, operation, host, port, path, data=None):
+        return await self.request(operation, "POST", host, port, path, data=data)
+
+    async def request(self, operation, method, host, port, path, params=None, data=None):
+        if self.metrics is None:
+            return await self.send(operation, method, host, port, path, params, data)
+        with self.metrics.span("upstream", operation):
+            return await self.send(operation, method, host, port, path, params, data)
+
+    async def send(self, operation, method, host, port, path, params=None, data=None):
+        server_key = "%s:%s" % (str(host), int(port))
+        if not self.allow(server_key):
+            raise CircuitOpenError("Circuit open for %s" % server_key)
+
+        url = "http://%s%s" % (server_key, path)
+        timeout = self.client_timeout(operation)
+        attempts = 1 + (self.retries if method == "GET" else 0)
+        for attempt in range(attempts):
+            try:
+                async with self.session().request(method, url, params=params, data=data, timeout=timeout) as response:
+                    response = UpstreamResponse(response.status, await response.read())
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                self.record_failure(server_key)
+                if attempt + 1 >= attempts:
+                    raise
+                logger.warning("%s %s failed (attempt %s/%s): %s", method, url, attempt + 1, attempts, e)
+                await asyncio.sleep(self.backoff * (2 ** attempt))
+                continue
+
+            if response.status_code >= 500:
+                self.record_failure(server_key)
+                if attempt + 1 < attempts:
+                    logger.warning("%s %s returned %s (attempt %s/%s)", method, url, response.status_code, attempt + 1, attempts)
+                    await asyncio.sleep(self.backoff * (2 ** attempt))
+                    continue
+            else:
+                self.record_success(server_key)
+            return response
+
+    def client_timeout(self, operation):
+        timeout = self.timeouts[operation]
+        if isinstance(timeout, tuple):
+            return aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+        return aiohttp.ClientTimeout(sock_connect=timeout, sock_read=timeout)
+
+    def session(self, server_key=None):
+        if self.client_session is None or self.client_session.closed:
+            self.client_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.connections))
+        return self.client_session
+
+    async def close(self):
+        if self.client_session is not None:
+            await self.client_session.close()
+            self.client_session = None
@@ -0,0 +1,131 @@
+from requests.adapters import BaseAdapter
+from requests.models import Response
+import requests
+import itertools
+import random
+import time
+import json
+import zlib
+import re
+
+try:
+    from urllib.parse import urlsplit, parse_qs
+except ImportError:
+    from urlparse import urlsplit, parse_qs
+
+import mongomock
+import fakeredis
+
+
+def install_database_fakes():
+    import pymongo
+    import redis
+
+    mongo_client = mongomock.MongoClient()
+    redis_client = fakeredis.FakeStrictRedis()
+    pymongo.MongoClient = lambda *args, **kwargs: mongo_client
+    redis.StrictRedis = lambda *args, **kwargs: redis_client
+    return mongo_client, redis_client
+
+
+def fake_inventory(bot_username, app_id, items, distinct_descriptions=200):
+    inventory = {}
+    descriptions = {}
+    base = zlib.crc32(bot_username.encode("utf-8")) % 10000000 * 100000
+    for position in range(items):
+        assetid = str(base + position)
+        classid = str(1000 + position % distinct_descriptions)
+        inventory[assetid] = {
+            "id": assetid,
+            "classid": classid,
+            "instanceid": "0",
+            "amount": "1",
+            "pos": position + 1
+        }
+        descriptions["%s_0" % classid] = {
+            "appid": app_id,
+            "classid": classid,
+            "instanceid": "0",
+            "market_hash_name": "Item %s" % classid,
+            "tradable": 1
+        }
+    return {"inventory": inventory, "descriptions": descriptions}
+
+
+class FakeBotServer():
+    def __init__(self, bots, items=100, latency=None, load=0.1):
+        self.bots = list(bots)
+        self.items = int(items)
+        self.latency = latency or {}
+        self.load = float(load)
+        self.random = random.Random(0)
+        self.counter = itertools.count(1)
+        self.routes = [
+            (re.compile(r"^/ping$"), "ping", self.ping),
+            (re.compile(r"^/stats$"), "stats", self.stats),
+            (re.compile(r"^/deposit$"), "deposit", self.deposit),
+            (re.compile(r"^/(?P<bot>[^/]+)/withdraw$"), "withdraw", self.withdraw),
+            (re.compile(r"^/bots/(?P<bot>[^/]+)/inventory/(?P<app_id>\d+)$"), "inventory", self.inventory)
+        ]
+
+    def handle(self, method, path, params, form):
+        for pattern, operation, handler in self.routes:
+            match = pattern.match(path)
+            if match:
+                if params.get("token") is None and form.get("token") is None:
+                    return 401, {}
+                time.sleep(self.latency.get(operation, self.latency.get("default", 0)))
+                return 200, handler(form, **match.groupdict())
+        return 404, {}
+
+    def ping(self, form):
+        return {}
+
+    def stats(self, form):
+        return {"load": self.load, "bots": [{"username": bot, "nickname": bot, "active": True} for bot in self.bots]}
+
+    def deposit(self, form):
+        return self.trade_offer(self.random.choice(self.bots))
+
+    def withdraw(self, form, bot):
+        return self.trade_offer(bot)
+
+    def inventory(self, form, bot, app_id):
+        return fake_inventory(bot, int(app_id), self.items)
+
+    def trade_offer(self, bot):
+        return {"security_code": "%06d" % self.random.randint(0, 999999), "task_id": "task-%s" % next(self.counter), "bot": bot}
+
+
+class FakeBotAdapter(BaseAdapter):
+    def __init__(self, bot_server):
+        BaseAdapter.__init__(self)
+        self.bot_server = bot_server
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        params = dict((key, values[0]) for key, values in parse_qs(url.query).items())
+        body = request.body or ""
+        if isinstance(body, bytes):
+            body = body.decode("utf-8")
+        form = dict((key, values[0]) for key, values in parse_qs(body).items())
+
+        status_code, payload = self.bot_server.handle(request.method, url.path, params, form)
+
+        response = Response()
+        response.status_code = status_code
+        response._content = json.dumps(payload).encode("utf-8")
+        response.headers["Content-Type"] = "application/json"
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def fake_session(bot_server):
+    session = requests.Session()
+    session.mount("http://", FakeBotAdapter(bot_server))
+    return session
@@ -0,0 +1,290 @@
+from multiprocessing.pool import ThreadPool
+import subprocess
+import threading
+import tempfile
+import argparse
+import random
+import time
+import json
+import sys
+import os
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "wsgi_app")]
+
+from benchmarks.fakes import install_database_fakes, fake_inventory, fake_session, FakeBotServer
+
+timer = getattr(time, "perf_counter", time.time)
+
+APP_ID = 730
+PROFILES = [
+    "inventory",
+    "inventory_changed",
+    "inventory_stream",
+    "withdraw",
+    "deposit",
+    "deposit_report",
+    "withdrawal_report",
+    "deposit_report_bulk",
+    "withdrawal_report_bulk"
+]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def parse_latency(values):
+    latency = {}
+    for value in values or []:
+        operation, _, seconds = value.rpartition("=")
+        latency[operation or "default"] = float(seconds)
+    return latency
+
+
+class Benchmark():
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.local = threading.local()
+        self.config = {
+            "ALLOW_IPS": ["127.0.0.1"],
+            "APP_SECRET": "benchmark",
+            "CRYPTO_SALT": "SALTsaltSALTsaltSALTsaltSALTsalt",
+            "ACCESS_TOKEN": "benchmark",
+            "REDIS_HOST": "localhost",
+            "REDIS_PORT": 6379,
+            "REDIS_PASSWORD": None,
+            "ENSURE_INDEXES": False,
+            "SERVER_POLLER_ENABLED": False,
+            "WITHDRAW_WORKERS": args.concurrency
+        }
+
+        handle, self.config_path = tempfile.mkstemp(suffix=".json")
+        with os.fdopen(handle, "w") as config_file:
+            json.dump(self.config, config_file)
+        os.environ["TRADE_API_CONFIG"] = self.config_path
+
+        install_database_fakes()
+        import wsgi_app.app as trade_app
+        self.trade_app = trade_app
+        self.trade_app.app.debug = False
+        self.seed()
+
+    def close(self):
+        os.remove(self.config_path)
+
+    def seed(self):
+        args = self.args
+        latency = parse_latency(args.latency)
+        self.bot_keys = []
+        for server_index in range(args.servers):
+            host, port = "10.0.0.%d" % (server_index + 1), 8080
+            bots = ["bench_%d_%d" % (server_index, bot_index) for bot_index in range(args.bots)]
+            bot_server = FakeBotServer(bots, args.items, latency)
+            server_id = self.trade_app.db_servers.add("bench-%d" % server_index, host, port)
+            self.trade_app.upstream.sessions["%s:%s" % (host, port)] = fake_session(bot_server)
+            for bot in bots:
+                self.trade_app.db_inventories.set_inventory(server_id, bot, APP_ID, fake_inventory(bot, APP_ID, args.items))
+                self.trade_app.inventory_snapshots.touch(APP_ID, server_id, bot)
+                self.bot_keys.append((server_id, bot))
+            self.trade_app.server_loads.observe(server_id, {"success": True, "load": bot_server.load, "bots": bots}, 0.0)
+        self.trade_app.server_loads.mark_fresh()
+
+        snapshot = self.trade_app.inventory_snapshots.get(APP_ID)
+        self.assets = []
+        for key in sorted(snapshot.inventory.keys()):
+            item = snapshot.inventory[key]
+            self.assets.append({"assetid": item["id"], "app_id": APP_ID, "points": 1, "bot": item["bot"], "server": item["server"]})
+        self.random.shuffle(self.assets)
+
+        self.steam_ids = [str(76561198000000000 + user) for user in range(args.users)]
+        self.withdrawal_bots = {}
+        for steam_id in self.steam_ids:
+            server_id, bot = self.random.choice(self.bot_keys)
+            self.trade_app.db_deposits.add(server_id, steam_id, "token", [], "http://localhost/report", "000000", "task", bot, {})
+            self.trade_app.db_withdrawals.add(server_id, steam_id, "token", [], "http://localhost/report", "000000", "task", bot, bot, {})
+            self.withdrawal_bots[steam_id] = bot
+
+    def client(self):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = self.trade_app.app.test_client()
+        return client
+
+    def send(self, spec):
+        method, path, data, before = spec
+        if before:
+            before()
+        started = timer()
+        path = "%s%stoken=%s" % (path, "&" if "?" in path else "?", self.config["ACCESS_TOKEN"])
+        response = self.client().open(path, method=method, data=data)
+        response.get_data()
+        return timer() - started, response.status_code
+
+    def trade_form(self, assets):
+        return {
+            "trade_token": "benchmark",
+            "report_url": "http://localhost/report",
+            "data": json.dumps({"source": "benchmark"}),
+            "assets": json.dumps(assets)
+        }
+
+    def touch_random_bot(self):
+        server_id, bot = self.random.choice(self.bot_keys)
+        self.trade_app.inventory_snapshots.touch(APP_ID, server_id, bot)
+
+    def report_form(self, **extra):
+        form = {"status": "2", "tradeoffer_id": str(self.random.randint(1, 10 ** 9))}
+        form.update(extra)
+        return form
+
+    def specs(self, profile, count):
+        if profile == "inventory":
+            return [("GET", "/trade/inventory/%s" % APP_ID, None, None)] * count
+        if profile == "inventory_changed":
+            return [("GET", "/trade/inventory/%s" % APP_ID, None, self.touch_random_bot)] * count
+        if profile == "inventory_stream":
+            return [("GET", "/trade/inventory/%s?stream=1" % APP_ID, None, None)] * count
+        if profile == "withdraw":
+            per_trade = self.args.assets_per_trade
+            count = min(count, len(self.assets) // per_trade)
+            return [
+                ("POST", "/trade/withdrawals/%s/add" % self.random.choice(self.steam_ids), self.trade_form([dict(asset) for asset in self.assets[i * per_trade:(i + 1) * per_trade]]), None)
+                for i in range(count)
+            ]
+        if profile == "deposit":
+            per_trade = self.args.assets_per_trade
+            return [
+                ("POST", "/trade/deposits/%s/add" % self.random.choice(self.steam_ids), self.trade_form([{"assetid": str(i * per_trade + j), "app_id": APP_ID} for j in range(per_trade)]), None)
+                for i in range(count)
+            ]
+        if profile == "deposit_report":
+            return [("POST", "/trade/deposits/%s/report" % steam_id, self.report_form(), None) for steam_id in self.sample_steam_ids(count)]
+        if profile == "withdrawal_report":
+            return [
+                ("POST", "/trade/withdrawals/%s/report" % steam_id, self.report_form(bot=self.withdrawal_bots[steam_id]), None)
+                for steam_id in self.sample_steam_ids(count)
+            ]
+        if profile == "deposit_report_bulk":
+            return [
+                ("POST", "/trade/deposits/report", {"reports": json.dumps([dict(self.report_form(), steam_id=steam_id) for steam_id in self.sample_steam_ids(self.args.bulk_size)])}, None)
+                for i in range(count)
+            ]
+        if profile == "withdrawal_report_bulk":
+            return [
+                ("POST", "/trade/withdrawals/report", {"reports": json.dumps([dict(self.report_form(), steam_id=steam_id, bot=self.withdrawal_bots[steam_id]) for steam_id in self.sample_steam_ids(self.args.bulk_size)])}, None)
+                for i in range(count)
+            ]
+        raise ValueError("Unknown profile %s" % profile)
+
+    def sample_steam_ids(self, count):
+        return [self.random.choice(self.steam_ids) for i in range(count)]
+
+    def run_profile(self, profile):
+        specs = self.specs(profile, self.args.warmup + self.args.requests)
+        warmup, specs = specs[:self.args.warmup], specs[self.args.warmup:]
+        pool = ThreadPool(self.args.concurrency)
+        try:
+            pool.map(self.send, warmup, chunksize=1)
+
+            if self.args.trace_memory and tracemalloc:
+                tracemalloc.start()
+            started = timer()
+            results = pool.map(self.send, specs, chunksize=1)
+            elapsed = timer() - started
+            heap_peak = None
+            if self.args.trace_memory and tracemalloc:
+                heap_peak = tracemalloc.get_traced_memory()[1] / (1024.0 * 1024.0)
+                tracemalloc.stop()
+        finally:
+            pool.close()
+            pool.join()
+
+        latencies = [latency for latency, status_code in results]
+        return {
+            "profile": profile,
+            "requests": len(results),
+            "errors": len([status_code for latency, status_code in results if status_code >= 400]),
+            "p50_ms": percentile(latencies, 0.5) * 1000 if latencies else None,
+            "p99_ms": percentile(latencies, 0.99) * 1000 if latencies else None,
+            "throughput": len(results) / elapsed if elapsed else None,
+            "peak_rss_mb": peak_rss_mb(),
+            "heap_peak_mb": heap_peak
+        }
+
+
+def format_value(value, pattern):
+    return "-" if value is None else pattern % value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the trade API against in-process Mongo, Redis and bot server stand-ins.")
+    parser.add_argument("--profiles", default=",".join(PROFILES))
+    parser.add_argument("--servers", type=int, default=2)
+    parser.add_argument("--bots", type=int, default=10, help="bots per server")
+    parser.add_argument("--items", type=int, default=500, help="items per bot")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per profile")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--assets-per-trade", type=int, default=5)
+    parser.add_argument("--bulk-size", type=int, default=50)
+    parser.add_argument("--latency", action="append", help="bot server latency in seconds, [operation=]seconds, repeatable")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace-memory", action="store_true", help="report the Python heap peak per profile (slower)")
+    parser.add_argument("--in-process", action="store_true", help="run every profile in this process; peak RSS is then cumulative across profiles")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    profiles = [profile for profile in args.profiles.split(",") if profile]
+    if args.in_process or len(profiles) < 2:
+        benchmark = Benchmark(args)
+        try:
+            results = [benchmark.run_profile(profile) for profile in profiles]
+        finally:
+            benchmark.close()
+    else:
+        results = []
+        for profile in profiles:
+            output = subprocess.check_output([sys.executable, os.path.realpath(__file__)] + sys.argv[1:] + ["--profiles", profile, "--json"])
+            results += json.loads(output.decode("utf-8"))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print("%-24s %8s %7s %10s %10s %10s %10s %10s" % ("profile", "requests", "errors", "p50 ms", "p99 ms", "req/s", "rss MB", "heap MB"))
+    for result in results:
+        print("%-24s %8d %7d %10s %10s %10s %10s %10s" % (
+            result["profile"],
+            result["requests"],
+            result["errors"],
+            format_value(result["p50_ms"], "%.2f"),
+            format_value(result["p99_ms"], "%.2f"),
+            format_value(result["throughput"], "%.1f"),
+            format_value(result["peak_rss_mb"], "%.1f"),
+            format_value(result["heap_peak_mb"], "%.1f")
+        ))
+
+
+if __name__ == "__main__":
+    main()
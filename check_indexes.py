@@ -0,0 +1,11 @@
+from wsgi_app.app import db_servers, db_inventories, db_asset_locations, db_withdrawals, db_deposits
+from wsgi_app.indexes import ensure_indexes, check_query_plans
+import sys
+
+if __name__ == "__main__":
+    databases = [db_servers, db_inventories, db_asset_locations, db_withdrawals, db_deposits]
+    ensure_indexes(databases)
+    failures = check_query_plans(databases)
+    for failure in failures:
+        print("COLLSCAN on %s: %s (%s)" % (failure["collection"], failure["query"], " <- ".join(failure["stages"])))
+    sys.exit(1 if failures else 0)
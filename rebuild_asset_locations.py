@@ -0,0 +1,7 @@
+from wsgi_app.app import db_inventories, db_asset_locations
+
+if __name__ == "__main__":
+    for app_id in db_inventories.app_ids():
+        for inventory in db_inventories.iter_app_id(app_id, descriptions=False):
+            db_asset_locations.set_bot_assets(inventory["server_id"], inventory["bot"], app_id, inventory["inventory"])
+            print("Indexed %s assets of %s on %s for app %s" % (len(inventory["inventory"]), inventory["bot"], inventory["server_id"], app_id))
@@ -0,0 +1,4 @@
+from asgi_app.app import app
+
+if __name__ == "__main__":
+    app.run(port=8001, debug=True)
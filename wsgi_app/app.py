@@ -1,32 +1,82 @@
 from pymongo import MongoClient
-from flask import Flask, render_template, request, redirect, jsonify, abort, session
+from bson.errors import InvalidId
+from flask import Flask, Response, render_template as flask_render_template, request, redirect, jsonify as flask_jsonify, abort, session
 from redis import StrictRedis
 
-from simple_crypto import simple_encode, simple_decode
 import sys
 import os
 import json
 
-if sys.platform == 'win32':
+if os.environ.get("TRADE_API_CONFIG"):
+    CONFIG_PATH = os.environ["TRADE_API_CONFIG"]
+elif sys.platform == 'win32':
     CONFIG_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..\\cfg\\default.json')
 else:
     CONFIG_PATH = '/usr/share/www/steam-trade-api/cfg/deploy.json'
 
 from config.config import Configurator
 from servers import DatabaseServers
+from upstream import UpstreamClient
 from inventories import DatabaseInventories
+from locations import DatabaseAssetLocations
 from withdrawals import DatabaseWithdrawals
 from deposits import DatabaseDeposits
+from snapshots import InventorySnapshots
+from inventory_index import parse_inventory_query
+from negotiation import JSON_MIMETYPE, negotiate_mimetype, negotiate_inventory, stream_requested, finish_inventory_response, response_encoding, set_compressed_body, representation_tag, serialize, compress_stream
+from reservations import AssetReservations
+from loads import ServerLoads
+from dispatch import Dispatcher
+from poller import ServerPoller
+from indexes import ensure_indexes
+from refresh import InventoryRefreshQueue
+from cache import ActiveTradesCache
+from codec import TokenCodec
+from trades import TradeError, parse_trade_request, prepare_withdrawal, withdrawal_jobs, record_withdrawals, prepare_deposit, deposit_jobs, record_deposits, trade_report_update, deposit_report_updates, update_deposit_reports, withdrawal_report_updates, update_withdrawal_reports
+from deltas import parse_inventory_delta, apply_inventory_delta
+from metrics import Metrics, TimedDatabase, instrument_redis
 
 CONFIG = Configurator(CONFIG_PATH)
 
-mongodb = MongoClient(CONFIG.get("MONGODB_HOST", "localhost:27017"))["tradeapi"]
-redis = StrictRedis(host=CONFIG["REDIS_HOST"], port=CONFIG["REDIS_PORT"], db=3, password=CONFIG["REDIS_PASSWORD"])
+metrics = Metrics(CONFIG.get("METRICS_BUCKETS", None))
+mongodb = TimedDatabase(MongoClient(CONFIG.get("MONGODB_HOST", "localhost:27017"))["tradeapi"], metrics)
+redis = instrument_redis(StrictRedis(host=CONFIG["REDIS_HOST"], port=CONFIG["REDIS_PORT"], db=3, password=CONFIG["REDIS_PASSWORD"]), metrics)
+
+upstream = UpstreamClient(
+    CONFIG.get("UPSTREAM_TIMEOUTS", {}),
+    CONFIG.get("UPSTREAM_RETRIES", 2),
+    CONFIG.get("UPSTREAM_BACKOFF", 0.2),
+    CONFIG.get("UPSTREAM_FAILURE_THRESHOLD", 5),
+    CONFIG.get("UPSTREAM_RESET_TIMEOUT", 30),
+    CONFIG.get("UPSTREAM_POOL_SIZE", 10),
+    metrics
+)
 
-db_servers = DatabaseServers(mongodb)
-db_inventories = DatabaseInventories(mongodb)
-db_withdrawals = DatabaseWithdrawals(mongodb)
-db_deposits = DatabaseDeposits(mongodb)
+db_servers = DatabaseServers(mongodb, upstream, CONFIG.get("SERVER_REGISTRY_TTL", 60))
+db_asset_locations = DatabaseAssetLocations(mongodb)
+db_inventories = DatabaseInventories(mongodb, CONFIG.get("INVENTORY_STORAGE_FORMAT", "json"), db_asset_locations)
+db_withdrawals = DatabaseWithdrawals(mongodb, ActiveTradesCache(redis, "active_withdrawals", CONFIG.get("ACTIVE_TRADES_CACHE_TTL", 300)))
+db_deposits = DatabaseDeposits(mongodb, ActiveTradesCache(redis, "active_deposits", CONFIG.get("ACTIVE_TRADES_CACHE_TTL", 300)))
+
+if CONFIG.get("ENSURE_INDEXES", True):
+    ensure_indexes([db_servers, db_inventories, db_asset_locations, db_withdrawals, db_deposits])
+
+token_codec = TokenCodec(CONFIG["CRYPTO_SALT"], CONFIG.get("TOKEN_CODEC_SIZE", 4096))
+inventory_snapshots = InventorySnapshots(db_inventories, redis, token_codec)
+asset_reservations = AssetReservations(redis, CONFIG.get("RESERVATION_TTL", 320))
+server_loads = ServerLoads(
+    redis,
+    db_servers,
+    CONFIG["ACCESS_TOKEN"],
+    CONFIG.get("SERVER_LOAD_MAX_AGE", 300),
+    CONFIG.get("SERVER_LOAD_HISTORY", 60),
+    CONFIG.get("SERVER_LOAD_ALPHA", 0.3),
+    CONFIG.get("SERVER_STATS_MAX_AGE", 90)
+)
+withdraw_dispatcher = Dispatcher(CONFIG.get("WITHDRAW_WORKERS", 8))
+deposit_dispatcher = Dispatcher(CONFIG.get("DEPOSIT_WORKERS", 8))
+server_poller = ServerPoller(redis, db_servers, server_loads, CONFIG["ACCESS_TOKEN"], CONFIG.get("SERVER_POLL_INTERVAL", 30), CONFIG.get("SERVER_POLL_WORKERS", 8))
+inventory_refresh_queue = InventoryRefreshQueue(db_servers, db_inventories, inventory_snapshots, CONFIG["ACCESS_TOKEN"], CONFIG.get("INVENTORY_REFRESH_WORKERS", 4))
 
 
 app = Flask(__name__)
@@ -36,6 +86,26 @@ app.config.update(
 )
 
 
+def render_template(template_name, **context):
+    with metrics.span("template", template_name):
+        return flask_render_template(template_name, **context)
+
+
+def jsonify(*args, **kwargs):
+    mimetype = negotiate_mimetype(request.accept_mimetypes)
+    if mimetype == JSON_MIMETYPE:
+        with metrics.span("json", "encode"):
+            return flask_jsonify(*args, **kwargs)
+    with metrics.span("msgpack", "encode"):
+        return Response(serialize(args[0] if args else kwargs, mimetype), mimetype=mimetype)
+
+
+def trade_error(error):
+    if error.payload is not None:
+        return jsonify(**error.payload), error.status
+    return abort(error.status)
+
+
 def logged_in():
     return session.get("authorized", False)
 
@@ -48,6 +118,11 @@ def in_allowed_ips(ip_address):
 
 @app.before_request
 def before_request():
+    metrics.start_request()
+
+    if CONFIG.get("SERVER_POLLER_ENABLED", True):
+        server_poller.start()
+
     if not in_allowed_ips(request.remote_addr):
         return abort(404)
 
@@ -57,13 +132,49 @@ def before_request():
             session["authorized"] = True
 
 
+@app.after_request
+def after_request(response):
+    timings = metrics.finish_request(request.method, request.url_rule.rule if request.url_rule else "unmatched", response.status_code)
+    if timings and CONFIG.get("SERVER_TIMING", False):
+        response.headers["Server-Timing"] = timings.server_timing()
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    encoding = response_encoding(response, request.accept_encodings, CONFIG.get("RESPONSE_COMPRESSION", True))
+    if encoding and not response.direct_passthrough and not response.is_streamed:
+        body = response.get_data()
+        if len(body) >= CONFIG.get("RESPONSE_COMPRESS_MIN_SIZE", 1024):
+            with metrics.span("compress", encoding):
+                set_compressed_body(response, body, encoding)
+    return response
+
+
 @app.route("/", methods=["GET"])
 def index():
     if logged_in():
-        processing_deposits = db_deposits.get_processing()
-        processing_withdrawals = db_withdrawals.get_processing()
+        page_size = CONFIG.get("DASHBOARD_PAGE_SIZE", 50)
+        deposits_after = request.args.get("deposits_after") or None
+        withdrawals_after = request.args.get("withdrawals_after") or None
+
+        try:
+            processing_deposits, deposits_next = db_deposits.get_processing_page(deposits_after, page_size)
+            processing_withdrawals, withdrawals_next = db_withdrawals.get_processing_page(withdrawals_after, page_size)
+        except InvalidId:
+            return abort(400)
 
-        return render_template("index.jinja2", deposits=processing_deposits, withdrawals=processing_withdrawals)
+        return render_template(
+            "index.jinja2",
+            deposits=processing_deposits,
+            withdrawals=processing_withdrawals,
+            deposit_counts=db_deposits.count_processing(),
+            withdrawal_counts=db_withdrawals.count_processing(),
+            deposits_after=deposits_after,
+            deposits_next=deposits_next,
+            withdrawals_after=withdrawals_after,
+            withdrawals_next=withdrawals_next
+        )
     return abort(401)
 
 
@@ -71,6 +182,9 @@ def index():
 def servers():
     if logged_in():
         servers = db_servers.get_all()
+        server_states = server_poller.get_many([server["_id"] for server in servers])
+        for server in servers:
+            server.update(server_states[server["_id"]])
         return render_template("servers.jinja2", servers=servers)
     return abort(401)
 
@@ -86,29 +200,49 @@ def settings():
 def servers_add():
     if logged_in():
         name = request.form.get("name", None)
-        host = request.form.get("host", None)
-        port = request.form.get("port", 80)
+        host = (request.form.get("host") or "").strip()
+        try:
+            port = int(request.form.get("port") or 80)
+        except ValueError:
+            return abort(400)
+        if not host or not 0 < port < 65536:
+            return abort(400)
 
-        if db_servers.ping(host, port, CONFIG["ACCESS_TOKEN"]):
-            db_servers.add(name, str(host), int(port))
+        server_id = db_servers.add(name, host, port)
+        if server_id:
+            server_poller.poll_async({"_id": server_id, "host": host, "port": port})
 
         return redirect("/servers")
     return abort(401)
 
 
+@app.route("/servers/<string:server_id>/remove", methods=["POST"])
+def servers_id_remove(server_id):
+    if logged_in():
+        try:
+            removed = db_servers.remove(server_id)
+        except InvalidId:
+            return abort(400)
+        if removed:
+            server_loads.remove(server_id)
+            server_poller.forget(server_id)
+            return redirect("/servers")
+        return abort(404)
+    return abort(401)
+
+
 @app.route("/servers/<string:server_id>", methods=["GET"])
 def servers_id(server_id):
     if logged_in():
         server = db_servers.get(server_id)
-        server["status"] = None
-        server["bots"] = None
-        server["load"] = None
 
         if server:
-            server["status"] = db_servers.ping(server["host"], server["port"], CONFIG["ACCESS_TOKEN"])
-            server_stats = db_servers.fetch_server_stats(server["host"], server["port"], CONFIG["ACCESS_TOKEN"])
-            server["load"] = server_stats["load"]
-            server["bots"] = server_stats["bots"]
+            server.update(server_poller.get(server_id))
+            server["history"] = server_loads.history(server_id)
+            if server["bots"]:
+                reserved_counts = asset_reservations.reserved_counts(server["_id"], [bot["username"] for bot in server["bots"]])
+                for bot in server["bots"]:
+                    bot["reserved"] = reserved_counts.get(bot["username"], 0)
             return render_template("server.jinja2", server=server)
         return abort(404)
     return abort(401)
@@ -160,26 +294,40 @@ def servers_id_bot_remove(server_id):
 @app.route("/trade/inventory/<int:app_id>", methods=["GET"])
 def trade_inventory(app_id):
     if logged_in():
-        global_inventory = {
-            "inventory": {},
-            "descriptions": {}
-        }
-        inventories = db_inventories.get_all_app_id(app_id)
-        for inventory in inventories:
-            _inventory = json.loads(inventory["inventory"])
-            inventory["inventory"] = _inventory["inventory"]
-            inventory["descriptions"] = _inventory["descriptions"]
-            crypted_bot = simple_encode(CONFIG["CRYPTO_SALT"], str(inventory["bot"]))
-            crypted_server = simple_encode(CONFIG["CRYPTO_SALT"], str(inventory["server_id"]))
-            for key, item in inventory["inventory"].iteritems():
-                item["bot"] = crypted_bot
-                item["server"] = crypted_server
-                global_inventory["inventory"]["%s_%s" % (key, crypted_bot)] = item
-            for key, description in inventory["descriptions"].iteritems():
-                global_inventory["descriptions"][key] = description
-
-        is_empty = len(global_inventory["inventory"].keys()) == 0
-        return jsonify(inventory=global_inventory["inventory"], descriptions=global_inventory["descriptions"], empty=is_empty), 200
+        stream = stream_requested(request.args.get("stream"), CONFIG.get("INVENTORY_STREAMING", False))
+        mimetype, streaming, encoding = negotiate_inventory(request.accept_mimetypes, request.accept_encodings, stream, CONFIG.get("RESPONSE_COMPRESSION", True))
+        representation = representation_tag(mimetype, encoding)
+
+        etag = inventory_snapshots.etag(app_id, inventory_snapshots.version(app_id)) + representation
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        elif streaming:
+            chunks = inventory_snapshots.stream(app_id)
+            response = Response(compress_stream(chunks) if encoding else chunks, status=200, mimetype=mimetype)
+        else:
+            snapshot = inventory_snapshots.get(app_id)
+            with metrics.span("encode", "inventory%s" % representation):
+                body = snapshot.encoded(mimetype, encoding)
+            response = Response(body, status=200, mimetype=mimetype)
+            etag = snapshot.etag + representation
+        return finish_inventory_response(response, etag, encoding)
+    return abort(401)
+
+
+@app.route("/trade/inventory/<int:app_id>/query", methods=["GET"])
+def trade_inventory_query(app_id):
+    if logged_in():
+        try:
+            query = parse_inventory_query(request.args, CONFIG.get("INVENTORY_QUERY_MAX_LIMIT", 200))
+        except ValueError:
+            return abort(400)
+
+        inventory_index = inventory_snapshots.index(app_id)
+        try:
+            page = inventory_index.query(**query)
+        except TypeError:
+            return abort(400)
+        return jsonify(**page), 200
     return abort(401)
 
 
@@ -202,216 +350,134 @@ def trade_deposits_active(steam_id):
 @app.route("/trade/withdrawals/<string:steam_id>/add", methods=["POST"])
 def trade_withdrawals_add(steam_id):
     if logged_in():
-        trade_token = request.form.get("trade_token")
-        report_url = request.form.get("report_url")
-
-        additional = request.form.get("data")
-        assets = request.form.get("assets")
-
-        if not trade_token or not report_url or not assets:
-            return abort(400)
-
+        with metrics.span("json", "decode"):
+            trade_request = parse_trade_request(request.form)
         try:
-            additional = json.loads(additional)
-            assets = json.loads(assets)
-        except:
-            return abort(400)
-
-        if len(assets) == 0:
-            return abort(400)
-        elif len(assets) > 50:
-            return abort(400)
-
-        # TODO: Check settings restrictions
-
-        additional.pop("token", None)
-
-        withdrawal_requests = {}
-        withdrawal_points = {}
-        keys_to_reserve = {}
-        reserved_keys = redis.keys("reserved_*")
-
-        for asset in assets:
-            reserve_key = "reserved_%s_%s_%s_%s" % (asset["server"], asset["bot"], asset["app_id"], asset["assetid"])
-            if reserve_key in reserved_keys:
-                return abort(400)
-
-            bot_username = simple_decode(CONFIG["CRYPTO_SALT"], asset["bot"])
-            server_id = simple_decode(CONFIG["CRYPTO_SALT"], asset["server"])
-            asset_key = "%s_%s" % (server_id, bot_username)
-            asset.pop("bot", None)
-            asset.pop("server", None)
-            if asset_key not in withdrawal_requests:
-                withdrawal_requests[asset_key] = [asset]
-                withdrawal_points[asset_key] = int(asset["points"])
-                keys_to_reserve[asset_key] = [reserve_key]
-            else:
-                withdrawal_requests[asset_key].append(asset)
-                withdrawal_points[asset_key] += int(asset["points"])
-                keys_to_reserve[asset_key].append(reserve_key)
-
-        if len(withdrawal_requests.keys()) == 0:
-            return abort(400)
-
-        request_results = []
-        points = 0
-
-        for key, withdrawal_request in withdrawal_requests.iteritems():
-            split_key = key.split("_")
-            server_id = split_key[0]
-            bot_username = split_key[1]
-            additional["points"] = int(withdrawal_points[key])
-            assets = withdrawal_request
-            points += additional["points"]
-
-            result = db_servers.withdraw(server_id, steam_id, trade_token, assets, bot_username, report_url, additional, CONFIG["ACCESS_TOKEN"])
-
-            if result.get("success", False):
-                for r_key in keys_to_reserve[key]:
-                    redis.set(r_key, True, ex=320)
+            withdrawal = prepare_withdrawal(trade_request, db_asset_locations, asset_reservations, token_codec)
+        except TradeError as e:
+            return trade_error(e)
 
-                security_code = result["security_code"]
-                celery_task_id = result["task_id"]
-                bot_nickname = result["bot"]
-
-                new_withdraw_result = db_withdrawals.add(server_id, steam_id, trade_token, assets, report_url, security_code, celery_task_id, bot_nickname, bot_username, additional)
-                if new_withdraw_result:
-                    request_results.append({"security_code": security_code, "task_id": celery_task_id, "bot": bot_nickname})
-
-        additional["points"] = points
-        return jsonify(withdrawals=request_results, data=additional), 200
+        results = withdraw_dispatcher.map(metrics.bound(db_servers.withdraw), withdrawal_jobs(steam_id, withdrawal, CONFIG["ACCESS_TOKEN"], db_servers.get))
+        return jsonify(**record_withdrawals(steam_id, withdrawal, results, db_withdrawals, asset_reservations)), 200
     return abort(401)
 
 
 @app.route("/trade/deposits/<string:steam_id>/add", methods=["POST"])
 def trade_deposits_add(steam_id):
     if logged_in():
-        trade_token = request.form.get("trade_token")
-        report_url = request.form.get("report_url")
-
-        additional = request.form.get("data")
-        assets = request.form.get("assets")
-
-        if not trade_token or not report_url or not assets:
-            return abort(400)
-
+        with metrics.span("json", "decode"):
+            trade_request = parse_trade_request(request.form)
         try:
-            additional = json.loads(additional)
-            assets = json.loads(assets)
-        except:
-            return abort(400)
-
-        if len(assets) == 0:
-            return abort(400)
-
-        # TODO: Check settings restrictions
-
-        minimal_load = -1.0
-        minimal_load_id = None
-        server_load_keys = redis.keys("server_load_*")
-
-        if len(server_load_keys) == 0:
-            servers = db_servers.get_all()
-            for server in servers:
-                server_load = db_servers.fetch_server_stats(server["host"], server["port"], CONFIG["ACCESS_TOKEN"])
-                if server_load.get("success", False):
-                    redis.set("server_load_%s" % server["_id"], server_load["load"], ex=300)
-                    server_load_keys.append("server_load_%s" % server["_id"])
-
-        for server_load_key in server_load_keys:
-            server_id = server_load_key.split("_load_")[1]
-            server_load = float(redis.get(server_load_key))
-            if server_load <= minimal_load or minimal_load == -1.0:
-                minimal_load = server_load
-                minimal_load_id = server_id
-
-        if minimal_load > 0.9 or not minimal_load_id:
-            return abort(503)
-
-        additional.pop("token", None)
-        result = db_servers.deposit(minimal_load_id, steam_id, trade_token, assets, report_url, additional, CONFIG["ACCESS_TOKEN"])
-
-        if result.get("success", False):
-            security_code = result["security_code"]
-            celery_task_id = result["task_id"]
-            deposit_data = {
-                "bot": result["bot"]
-            }
-            new_deposit_result = db_deposits.add(minimal_load_id, steam_id, trade_token, assets, report_url, security_code, celery_task_id, result["bot"], additional)
-            return jsonify(security_code=security_code, data=deposit_data), 200
-        return abort(500)
+            deposit = prepare_deposit(trade_request, server_loads, CONFIG.get("DEPOSIT_MAX_ASSETS", 500), CONFIG.get("DEPOSIT_MAX_LOAD", 0.9), CONFIG.get("DEPOSIT_MAX_ASSETS_PER_TRADE", 50))
+            results = deposit_dispatcher.map(metrics.bound(db_servers.deposit), deposit_jobs(steam_id, deposit, CONFIG["ACCESS_TOKEN"], db_servers.get))
+            return jsonify(**record_deposits(steam_id, deposit, results, db_deposits)), 200
+        except TradeError as e:
+            return trade_error(e)
     return abort(401)
 
 
 @app.route("/trade/deposits/<string:steam_id>/report", methods=["POST"])
 def trade_deposits_report(steam_id):
     if logged_in():
-        error_message = request.form.get("error")
-        celery_task_id = request.form.get("celery_task_id")
-        tradeoffer_id = request.form.get("tradeoffer_id")
-        status = int(request.form.get("status"))
-        db_deposits.change_status_last(steam_id, status)
-
-        if tradeoffer_id:
-            db_deposits.set_data(steam_id, "tradeoffer_id", tradeoffer_id)
-
-        if celery_task_id:
-            db_deposits.change_celery_task_id_last(steam_id, celery_task_id)
-
-        if error_message:
-            db_deposits.change_message_last(steam_id, error_message)
-        return "OK", 200
+        fields, data = trade_report_update(request.form)
+        if db_deposits.update_last(steam_id, fields, data, request.form.get("security_code")):
+            return "OK", 200
+        return abort(404)
     return abort(401)
 
 
 @app.route("/trade/withdrawals/<string:steam_id>/report", methods=["POST"])
 def trade_withdrawals_report(steam_id):
     if logged_in():
-        error_message = request.form.get("error")
-        celery_task_id = request.form.get("celery_task_id")
         bot_username = request.form.get("bot")
-        tradeoffer_id = request.form.get("tradeoffer_id")
-        status = int(request.form.get("status"))
-        db_withdrawals.change_status_last(steam_id, bot_username, status)
+        fields, data = trade_report_update(request.form)
+        if db_withdrawals.update_last(steam_id, bot_username, fields, data):
+            return "OK", 200
+        return abort(404)
+    return abort(401)
+
 
-        if tradeoffer_id:
-            db_withdrawals.set_data(steam_id, bot_username, "tradeoffer_id", tradeoffer_id)
+@app.route("/trade/deposits/report", methods=["POST"])
+def trade_deposits_report_bulk():
+    if logged_in():
+        try:
+            with metrics.span("json", "decode"):
+                updates = deposit_report_updates(json.loads(request.form.get("reports")))
+        except (TypeError, ValueError, KeyError):
+            return abort(400)
+        return jsonify(**update_deposit_reports(updates, db_deposits)), 200
+    return abort(401)
 
-        if celery_task_id:
-            db_withdrawals.change_celery_task_id_last(steam_id, bot_username, celery_task_id)
 
-        if error_message:
-            db_withdrawals.change_message_last(steam_id, bot_username, error_message)
-        return "OK", 200
+@app.route("/trade/withdrawals/report", methods=["POST"])
+def trade_withdrawals_report_bulk():
+    if logged_in():
+        try:
+            with metrics.span("json", "decode"):
+                updates = withdrawal_report_updates(json.loads(request.form.get("reports")))
+        except (TypeError, ValueError, KeyError):
+            return abort(400)
+        return jsonify(**update_withdrawal_reports(updates, db_withdrawals)), 200
     return abort(401)
 
 
+def report_server():
+    server_host = request.remote_addr
+    if server_host == "127.0.0.1" and CONFIG_PATH.endswith("deploy.json"):
+        server_host = "185.46.10.189"
+    return db_servers.get_host(server_host)
+
+
 @app.route("/trade/inventory/<int:app_id>/report", methods=["POST"])
 def trade_inventory_report(app_id):
     if logged_in():
-        server_host = request.remote_addr
-        if server_host == "127.0.0.1" and CONFIG_PATH.endswith("deploy.json"):
-            server_host = "185.46.10.189"
-        server = db_servers.get_host(server_host)
+        server = report_server()
         app_id = int(app_id)
         bot_username = request.form.get("bot", None)
 
-        if bot_username:
-            response = db_servers.request_inventory(server["host"], server["port"], bot_username, app_id, CONFIG["ACCESS_TOKEN"])
-            if response.get("success", False):
-                result = db_inventories.set_inventory(
-                    server["_id"],
-                    bot_username,
-                    app_id,
-                    {"inventory": response["inventory"], "descriptions": response["descriptions"]}
-                )
-                if result:
-                    return "OK", 200
-                return "Database inventory update error", 500
+        if server and bot_username:
+            inventory_refresh_queue.enqueue(server, bot_username, app_id)
+            return "OK", 200
         return abort(400)
     return abort(401)
 
 
+@app.route("/trade/inventory/<int:app_id>/delta", methods=["POST"])
+def trade_inventory_delta(app_id):
+    if logged_in():
+        server = report_server()
+        app_id = int(app_id)
+        bot_username = request.form.get("bot", None)
+
+        if not server or not bot_username:
+            return abort(400)
+
+        try:
+            with metrics.span("json", "decode"):
+                delta = parse_inventory_delta(request.form)
+        except ValueError:
+            return abort(400)
+
+        if apply_inventory_delta(server, bot_username, app_id, delta, db_inventories, inventory_snapshots, CONFIG.get("INVENTORY_RECONCILE_INTERVAL", 3600)):
+            inventory_refresh_queue.enqueue(server, bot_username, app_id)
+        return "OK", 200
+    return abort(401)
+
+
+@app.route("/trade/inventory/refresh/status", methods=["GET"])
+def trade_inventory_refresh_status():
+    if logged_in():
+        return jsonify(inventory_refresh_queue.status()), 200
+    return abort(401)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_export():
+    if logged_in():
+        return Response(metrics.render(), status=200, mimetype="text/plain; version=0.0.4")
+    return abort(401)
+
+
 @app.route("/logout", methods=["GET"])
 def logout():
     if logged_in():
@@ -0,0 +1,47 @@
+import json
+
+
+STORE_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+
+class ActiveTradesCache():
+    def __init__(self, redis, prefix, ttl=300):
+        self.redis = redis
+        self.prefix = prefix
+        self.ttl = int(ttl)
+        self.store_script = redis.register_script(STORE_SCRIPT)
+
+    def key(self, steam_id):
+        return "%s_%s" % (self.prefix, steam_id)
+
+    def generation_key(self, steam_id):
+        return "%s_generation_%s" % (self.prefix, steam_id)
+
+    def get(self, steam_id, loader):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.get(self.key(steam_id))
+        pipe.get(self.generation_key(steam_id))
+        cached, generation = pipe.execute()
+        if cached is not None:
+            return json.loads(cached)
+
+        trades = loader()
+        self.store_script(
+            keys=[self.key(steam_id), self.generation_key(steam_id)],
+            args=[generation or 0, json.dumps(trades), self.ttl]
+        )
+        return trades
+
+    def invalidate(self, steam_ids):
+        pipe = self.redis.pipeline(transaction=True)
+        for steam_id in set(steam_ids):
+            pipe.incr(self.generation_key(steam_id))
+            pipe.expire(self.generation_key(steam_id), 86400)
+            pipe.delete(self.key(steam_id))
+        pipe.execute()
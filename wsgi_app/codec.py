@@ -0,0 +1,26 @@
+from simple_crypto import simple_encode
+from collections import OrderedDict
+import threading
+
+
+class TokenCodec():
+    def __init__(self, crypto_salt, size=4096):
+        self.size = int(size)
+        self.lock = threading.Lock()
+        self.crypto_salt = crypto_salt
+        self.encoded = OrderedDict()
+
+    def encode(self, value):
+        value = str(value)
+        with self.lock:
+            token = self.encoded.pop(value, None)
+            if token is not None:
+                self.encoded[value] = token
+                return token
+
+        token = simple_encode(self.crypto_salt, value)
+        with self.lock:
+            self.encoded[value] = token
+            while len(self.encoded) > self.size:
+                self.encoded.popitem(last=False)
+        return token
@@ -0,0 +1,21 @@
+import datetime
+import json
+
+
+def parse_inventory_delta(form):
+    added = json.loads(form.get("added") or "{}")
+    removed = json.loads(form.get("removed") or "[]")
+    descriptions = json.loads(form.get("descriptions") or "{}")
+    if not isinstance(added, dict) or not isinstance(removed, list) or not isinstance(descriptions, dict):
+        raise ValueError("Invalid inventory delta")
+    return added, removed, descriptions
+
+
+def apply_inventory_delta(server, bot_username, app_id, delta, db_inventories, inventory_snapshots, reconcile_interval=3600):
+    added, removed, descriptions = delta
+    reconciled = db_inventories.apply_delta(server["_id"], bot_username, app_id, added, removed, descriptions)
+    if reconciled is None:
+        return True
+
+    inventory_snapshots.touch(app_id, server["_id"], bot_username)
+    return datetime.datetime.utcnow() - reconciled > datetime.timedelta(seconds=reconcile_interval)
@@ -1,23 +1,174 @@
 from bson.objectid import ObjectId
+from pymongo import UpdateOne, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from collections import OrderedDict
 import json
 
 
 class DatabaseDeposits():
-    def __init__(self, db):
+    indexes = [
+        {"keys": [("steam_id", ASCENDING), ("status", ASCENDING)]},
+        {"keys": [("steam_id", ASCENDING), ("_id", DESCENDING)]},
+        {"keys": [("status", ASCENDING), ("_id", ASCENDING)]}
+    ]
+
+    def __init__(self, db, cache=None):
         self.collection = db["deposits"]
+        self.cache = cache
+
+    def query_shapes(self):
+        return [
+            {"filter": {"status": {"$lt": 3}}},
+            {"filter": {"status": {"$in": [0, 1, 2]}}, "sort": [("_id", ASCENDING)]},
+            {"filter": {"status": {"$in": [0, 1, 2]}, "_id": {"$gt": ObjectId()}}, "sort": [("_id", ASCENDING)]},
+            {"filter": {"steam_id": "0", "status": {"$lt": 3}}},
+            {"filter": {"steam_id": "0", "status": {"$gte": 3}}},
+            {"filter": {"steam_id": "0"}, "sort": [("_id", DESCENDING)]},
+            {"filter": {"steam_id": "0", "security_code": "000000"}, "sort": [("_id", DESCENDING)]},
+            {"filter": {"steam_id": {"$in": ["0", "1"]}}, "sort": [("_id", DESCENDING)]},
+            {"filter": {"steam_id": {"$in": ["0", "1"]}, "security_code": {"$in": ["000000"]}}, "sort": [("_id", DESCENDING)]}
+        ]
 
     def get(self, deposit_id):
-        return self.collection.find_one({"_id": ObjectId(deposit_id)}, {"_id": 0})
+        return self._serialize(self.collection.find_one({"_id": ObjectId(deposit_id)}, {"_id": 0}))
 
     def get_processing(self):
-        return list(self.collection.find({"status": {"$lt": 3}}, {"_id": 0}))
+        return [self._serialize(deposit) for deposit in self.collection.find({"status": {"$lt": 3}}, {"_id": 0})]
+
+    def get_processing_page(self, after=None, limit=50):
+        query = {"status": {"$in": self.collection.distinct("status", {"status": {"$lt": 3}})}}
+        if after:
+            query["_id"] = {"$gt": ObjectId(after)}
+        deposits = list(self.collection.find(query, {"server_id": 1, "steam_id": 1, "trade_token": 1, "assets": 1, "security_code": 1, "bot": 1, "data": 1, "celery_task_id": 1, "status": 1}).sort("_id", ASCENDING).limit(limit + 1))
+        next_cursor = None
+        if len(deposits) > limit:
+            deposits = deposits[:limit]
+            next_cursor = str(deposits[-1]["_id"])
+        for deposit in deposits:
+            deposit.pop("_id")
+            self._serialize(deposit)
+        return deposits, next_cursor
+
+    def count_processing(self):
+        counts = self.collection.aggregate([
+            {"$match": {"status": {"$lt": 3}}},
+            {"$group": {"_id": {"status": "$status", "server_id": "$server_id", "bot": "$bot"}, "count": {"$sum": 1}}},
+            {"$sort": {"_id.status": 1, "_id.server_id": 1, "_id.bot": 1}}
+        ])
+        return [dict(count["_id"], count=count["count"]) for count in counts]
 
     def get_steam_id(self, steam_id, active=True):
         if active:
-            return list(self.collection.find({"steam_id": steam_id, "status": {"$lt": 3}}, {"_id": 0}))
-        return list(self.collection.find({"steam_id": steam_id, "status": {"$gte": 3}}, {"_id": 0}))
+            if self.cache:
+                return self.cache.get(steam_id, lambda: self._get_steam_id_active(steam_id))
+            return self._get_steam_id_active(steam_id)
+        return [self._serialize(deposit) for deposit in self.collection.find({"steam_id": steam_id, "status": {"$gte": 3}}, {"_id": 0})]
+
+    def add(self, server_id, steam_id, trade_token, assets, report_url, security_code, celery_task_id, bot, additional, group_id=None):
+        result = self.collection.insert_one(self._new_deposit(server_id, steam_id, trade_token, assets, report_url, security_code, celery_task_id, bot, additional, group_id))
+        self._invalidate([steam_id])
+        return result.inserted_id is not None
+
+    def add_many(self, deposits):
+        if not deposits:
+            return True
+        result = self.collection.insert_many([self._new_deposit(**deposit) for deposit in deposits], ordered=False)
+        self._invalidate(list(set(deposit["steam_id"] for deposit in deposits)))
+        return len(result.inserted_ids) == len(deposits)
+
+    def set_data(self, steam_id, key, value):
+        return self.update_last(steam_id, data={key: value})
+
+    def change_status_last(self, steam_id, status):
+        return self.update_last(steam_id, {"status": int(status)})
+
+    def change_celery_task_id_last(self, steam_id, celery_task_id):
+        return self.update_last(steam_id, {"celery_task_id": celery_task_id})
 
-    def add(self, server_id, steam_id, trade_token, assets, report_url, security_code, celery_task_id, bot, additional):
+    def change_message_last(self, steam_id, message):
+        return self.update_last(steam_id, {"message": message})
+
+    def update_last(self, steam_id, fields=None, data=None, security_code=None):
+        query = {"steam_id": steam_id}
+        if security_code:
+            query["security_code"] = security_code
+        update_fields = dict(fields or {})
+        for key, value in (data or {}).items():
+            update_fields["data.%s" % key] = value
+        try:
+            last_deposit = self.collection.find_one_and_update(
+                query,
+                {"$set": update_fields},
+                sort=[("_id", -1)],
+                projection={"_id": 1}
+            )
+            if last_deposit is None:
+                return False
+        except OperationFailure:
+            last_deposit = self.collection.find_one(query, sort=[("_id", -1)])
+            update_fields = dict(fields or {})
+            update_fields["data"] = self._merge_data(last_deposit["data"], data)
+            result = self.collection.update_one({"_id": last_deposit["_id"]}, {"$set": update_fields})
+            if not result.acknowledged:
+                return False
+        self._invalidate([steam_id])
+        return True
+
+    def update_last_many(self, reports):
+        updates = OrderedDict()
+        for report in reports:
+            update = updates.setdefault(self._report_key(report), ({}, {}))
+            update[0].update(report.get("fields") or {})
+            update[1].update(report.get("data") or {})
+        if not updates:
+            return []
+
+        operations = []
+        updated = []
+        for key, last_deposit in self._last_deposits(list(updates.keys())):
+            if key not in updates:
+                continue
+            fields, data = updates[key]
+            update_fields = dict(fields)
+            if isinstance(last_deposit["data"], dict):
+                for name, value in data.items():
+                    update_fields["data.%s" % name] = value
+            elif data:
+                update_fields["data"] = self._merge_data(last_deposit["data"], data)
+            if update_fields:
+                operations.append(UpdateOne({"_id": last_deposit["last_id"]}, {"$set": update_fields}))
+            updated.append(key)
+
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+        self._invalidate(set(key[0] for key in updated))
+        return updated
+
+    def _report_key(self, report):
+        return report["steam_id"], report.get("security_code") or None
+
+    def _last_deposits(self, keys):
+        for keyed in (False, True):
+            group_keys = [key for key in keys if bool(key[1]) == keyed]
+            if not group_keys:
+                continue
+            match = {"steam_id": {"$in": list(set(key[0] for key in group_keys))}}
+            group_id = "$steam_id"
+            if keyed:
+                match["security_code"] = {"$in": list(set(key[1] for key in group_keys))}
+                group_id = {"steam_id": "$steam_id", "security_code": "$security_code"}
+            last_deposits = self.collection.aggregate([
+                {"$match": match},
+                {"$sort": {"_id": -1}},
+                {"$group": {"_id": group_id, "last_id": {"$first": "$_id"}, "data": {"$first": "$data"}}}
+            ])
+            for last_deposit in last_deposits:
+                if keyed:
+                    yield (last_deposit["_id"]["steam_id"], last_deposit["_id"]["security_code"]), last_deposit
+                else:
+                    yield (last_deposit["_id"], None), last_deposit
+
+    def _new_deposit(self, server_id, steam_id, trade_token, assets, report_url, security_code, celery_task_id, bot, additional, group_id=None):
         new_deposit = {
             "server_id": server_id,
             "steam_id": steam_id,
@@ -26,32 +177,29 @@ class DatabaseDeposits():
             "report_url": report_url,
             "security_code": security_code,
             "bot": bot,
-            "data": json.dumps(additional),
+            "data": additional,
             "celery_task_id": celery_task_id,
             "message": None,
             "status": 0
         }
-        result = self.collection.insert(new_deposit)
-        return result is not None
+        if group_id:
+            new_deposit["group_id"] = group_id
+        return new_deposit
 
-    def set_data(self, steam_id, key, value):
-        last_deposit = list(self.collection.find({"steam_id": steam_id}).limit(1).sort("_id", -1))[0]
-        last_data = json.loads(last_deposit["data"])
-        last_data[key] = value
-        result = self.collection.update({"_id": last_deposit["_id"]}, {"$set": {"data": json.dumps(last_data)}})
-        return result['ok'] == 1
+    def _merge_data(self, last_data, data):
+        if not isinstance(last_data, dict):
+            last_data = json.loads(last_data)
+        last_data.update(data or {})
+        return last_data
 
-    def change_status_last(self, steam_id, status):
-        last_deposit = list(self.collection.find({"steam_id": steam_id}).limit(1).sort("_id", -1))[0]
-        result = self.collection.update({"_id": last_deposit["_id"]}, {"$set": {"status": int(status)}})
-        return result['ok'] == 1
+    def _get_steam_id_active(self, steam_id):
+        return [self._serialize(deposit) for deposit in self.collection.find({"steam_id": steam_id, "status": {"$lt": 3}}, {"_id": 0})]
 
-    def change_celery_task_id_last(self, steam_id, celery_task_id):
-        last_deposit = list(self.collection.find({"steam_id": steam_id}).limit(1).sort("_id", -1))[0]
-        result = self.collection.update({"_id": last_deposit["_id"]}, {"$set": {"celery_task_id": celery_task_id}})
-        return result['ok'] == 1
+    def _invalidate(self, steam_ids):
+        if self.cache and steam_ids:
+            self.cache.invalidate(steam_ids)
 
-    def change_message_last(self, steam_id, message):
-        last_deposit = list(self.collection.find({"steam_id": steam_id}).limit(1).sort("_id", -1))[0]
-        result = self.collection.update({"_id": last_deposit["_id"]}, {"$set": {"message": message}})
-        return result['ok'] == 1
\ No newline at end of file
+    def _serialize(self, deposit):
+        if deposit and isinstance(deposit.get("data"), dict):
+            deposit["data"] = json.dumps(deposit["data"])
+        return deposit
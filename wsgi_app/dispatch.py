@@ -0,0 +1,18 @@
+from multiprocessing.pool import ThreadPool
+import threading
+
+
+class Dispatcher():
+    def __init__(self, workers=8):
+        self.workers = int(workers)
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def map(self, func, jobs):
+        if len(jobs) < 2:
+            return [func(*job) for job in jobs]
+
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPool(self.workers)
+        return self.pool.map(lambda job: func(*job), jobs)
@@ -0,0 +1,27 @@
+def ensure_indexes(databases, background=True):
+    for database in databases:
+        for index in database.indexes:
+            options = dict({"background": background}, **index.get("options", {}))
+            database.collection.create_index(index["keys"], **options)
+
+
+def plan_stages(plan):
+    stages = [plan.get("stage")]
+    if "inputStage" in plan:
+        stages += plan_stages(plan["inputStage"])
+    for input_stage in plan.get("inputStages", []):
+        stages += plan_stages(input_stage)
+    return stages
+
+
+def check_query_plans(databases):
+    failures = []
+    for database in databases:
+        for query_shape in database.query_shapes():
+            cursor = database.collection.find(query_shape["filter"])
+            if query_shape.get("sort"):
+                cursor = cursor.sort(query_shape["sort"])
+            stages = plan_stages(cursor.explain()["queryPlanner"]["winningPlan"])
+            if "COLLSCAN" in stages:
+                failures.append({"collection": database.collection.name, "query": query_shape, "stages": stages})
+    return failures
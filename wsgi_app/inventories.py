@@ -1,35 +1,162 @@
 from bson.objectid import ObjectId
+from bson.binary import Binary
+from pymongo import ASCENDING
 import datetime
 import json
+import zlib
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+STORAGE_FORMATS = ("json", "native", "zlib", "lz4")
 
 
 class DatabaseInventories():
-    def __init__(self, db):
+    indexes = [
+        {"keys": [("app_id", ASCENDING)]},
+        {"keys": [("server_id", ASCENDING), ("bot", ASCENDING), ("app_id", ASCENDING)]}
+    ]
+
+    def __init__(self, db, storage_format="json", asset_locations=None):
+        if storage_format not in STORAGE_FORMATS:
+            raise ValueError("Unknown inventory storage format: %s" % storage_format)
+        if storage_format == "lz4" and lz4 is None:
+            raise ValueError("lz4 inventory storage requires the lz4 package")
         self.collection = db["inventories"]
+        self.storage_format = storage_format
+        self.asset_locations = asset_locations
+
+    def query_shapes(self):
+        return [
+            {"filter": {"app_id": 730}},
+            {"filter": {"server_id": ObjectId(), "bot": "bot", "app_id": 730}}
+        ]
 
     def set_inventory(self, server_id, bot_username, app_id, inventory_json):
-        inventory = self.get(server_id, bot_username, app_id)
+        fields, unset_fields = self._encode(inventory_json)
+        fields["updated"] = datetime.datetime.utcnow()
+        fields["reconciled"] = fields["updated"]
+        result = self.collection.update_one(
+            {"server_id": ObjectId(server_id), "bot": str(bot_username), "app_id": int(app_id)},
+            {"$set": fields, "$unset": unset_fields},
+            upsert=True
+        )
+        if not result.acknowledged:
+            return False
+        if self.asset_locations:
+            self.asset_locations.set_bot_assets(server_id, bot_username, app_id, inventory_json["inventory"])
+        return True
+
+    def apply_delta(self, server_id, bot_username, app_id, added, removed, descriptions):
+        removed = set(str(assetid) for assetid in removed)
+        added = dict((str(assetid), item) for assetid, item in added.items() if str(assetid) not in removed)
+        query = {"server_id": ObjectId(server_id), "bot": str(bot_username), "app_id": int(app_id)}
         datetime_now = datetime.datetime.utcnow()
+
+        if self.storage_format == "native":
+            fields = {"updated": datetime_now}
+            for assetid, item in added.items():
+                fields["assets.%s" % assetid] = item
+            for key, description in descriptions.items():
+                fields["descriptions.%s" % key] = description
+            update = {"$set": fields}
+            if removed:
+                update["$unset"] = dict(("assets.%s" % assetid, "") for assetid in removed)
+            inventory = self.collection.find_one_and_update(dict(query, format="native"), update, projection={"reconciled": 1})
+            if inventory:
+                if self.asset_locations:
+                    self.asset_locations.apply_delta(server_id, bot_username, app_id, added, removed)
+                return inventory.get("reconciled", datetime.datetime.utcfromtimestamp(0))
+
+        inventory = self.get(server_id, bot_username, app_id)
+        if not inventory:
+            return None
+        for assetid in removed:
+            inventory["inventory"].pop(assetid, None)
+        inventory["inventory"].update(added)
+        inventory["descriptions"].update(descriptions)
+        fields, unset_fields = self._encode({"inventory": inventory["inventory"], "descriptions": inventory["descriptions"]})
+        fields["updated"] = datetime_now
+        result = self.collection.update_one(dict(query, updated=inventory.get("updated")), {"$set": fields, "$unset": unset_fields})
+        if not result.matched_count:
+            return None
+        if self.asset_locations:
+            self.asset_locations.apply_delta(server_id, bot_username, app_id, added, removed)
+        return inventory.get("reconciled", datetime.datetime.utcfromtimestamp(0))
+
+    def get(self, server_id, bot_username, app_id, assets=True, descriptions=True):
+        inventory = self.collection.find_one(
+            {"server_id": ObjectId(server_id), "bot": bot_username, "app_id": int(app_id)},
+            self._projection(assets, descriptions)
+        )
         if inventory:
-            result = self.collection.update(
-                {"server_id": ObjectId(server_id), "bot": bot_username},
-                {"$set": {"updated": datetime_now, "inventory": json.dumps(inventory_json)}}
-            )
+            return self._decode(inventory)
+        return None
+
+    def app_ids(self):
+        return self.collection.distinct("app_id")
+
+    def get_all_app_id(self, app_id, assets=True, descriptions=True):
+        return list(self.iter_app_id(app_id, assets, descriptions))
+
+    def iter_app_id(self, app_id, assets=True, descriptions=True):
+        for inventory in self.collection.find({"app_id": int(app_id)}, self._projection(assets, descriptions)):
+            yield self._decode(inventory)
+
+    def _projection(self, assets, descriptions):
+        projection = {"server_id": 1, "bot": 1, "app_id": 1, "updated": 1, "reconciled": 1, "format": 1, "inventory": 1}
+        if assets:
+            projection["assets"] = 1
+        if descriptions:
+            projection["descriptions"] = 1
+        return projection
+
+    def _encode(self, inventory_json):
+        if self.storage_format == "native":
+            fields = {
+                "format": "native",
+                "assets": inventory_json["inventory"],
+                "descriptions": inventory_json["descriptions"]
+            }
+            return fields, {"inventory": ""}
+
+        data = json.dumps(inventory_json)
+        if self.storage_format == "json":
+            return {"inventory": data}, {"format": "", "assets": "", "descriptions": ""}
+        if self.storage_format == "zlib":
+            data = zlib.compress(data.encode("utf-8"))
+        else:
+            data = lz4.frame.compress(data.encode("utf-8"))
+        return {"format": self.storage_format, "inventory": Binary(data)}, {"assets": "", "descriptions": ""}
+
+    def _decode(self, inventory):
+        storage_format = inventory.pop("format", "json")
+        data = inventory.pop("inventory", None)
+        if storage_format == "native":
+            inventory["inventory"] = inventory.pop("assets", {})
+            inventory.setdefault("descriptions", {})
         else:
-            result = {"ok": 1}
-            self.collection.insert({
-                "server_id": ObjectId(server_id),
-                "bot": str(bot_username),
-                "app_id": int(app_id),
-                "updated": datetime_now,
-                "inventory": json.dumps(inventory_json)
-            })
-        return result["ok"] == 1
-
-    def get(self, server_id, bot_username, app_id):
-        inventory_json = self.collection.find_one({"server_id": ObjectId(server_id), "bot": bot_username, "app_id": int(app_id)})
-        return inventory_json
-
-    def get_all_app_id(self, app_id):
-        inventories = list(self.collection.find({"app_id": int(app_id)}, {"_id": 0}))
-        return inventories
\ No newline at end of file
+            if storage_format == "zlib":
+                data = zlib.decompress(data).decode("utf-8")
+            elif storage_format == "lz4":
+                if lz4 is None:
+                    raise ValueError("lz4 inventory storage requires the lz4 package")
+                data = lz4.frame.decompress(data).decode("utf-8")
+            inventory_json = json.loads(data)
+            inventory["inventory"] = inventory_json["inventory"]
+            inventory["descriptions"] = inventory_json["descriptions"]
+            if storage_format != self.storage_format:
+                self._migrate(inventory, inventory_json)
+
+        inventory.pop("_id", None)
+        return inventory
+
+    def _migrate(self, inventory, inventory_json):
+        fields, unset_fields = self._encode(inventory_json)
+        self.collection.update_one(
+            {"_id": inventory["_id"], "updated": inventory.get("updated")},
+            {"$set": fields, "$unset": unset_fields}
+        )
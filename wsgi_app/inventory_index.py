@@ -0,0 +1,131 @@
+import bisect
+import base64
+import json
+
+
+SORTS = ("name", "classid", "assetid")
+
+
+def numeric_key(value):
+    value = str(value)
+    return [len(value), value] if value.isdigit() else [float("inf"), value]
+
+
+def encode_cursor(sort_key):
+    return base64.urlsafe_b64encode(json.dumps(sort_key).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        sort_key = json.loads(base64.urlsafe_b64decode(str(cursor)).decode("utf-8"))
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(sort_key, list):
+        raise ValueError("Invalid cursor")
+    return sort_key
+
+
+def parse_inventory_query(args, max_limit=200):
+    sort = args.get("sort") or "name"
+    order = args.get("order") or "asc"
+    if sort not in SORTS or order not in ("asc", "desc"):
+        raise ValueError("Unknown sort order")
+
+    tradable = args.get("tradable")
+    if tradable not in (None, "", "0", "1"):
+        raise ValueError("tradable must be 0 or 1")
+
+    limit = int(args.get("limit") or 30)
+    if limit < 1:
+        raise ValueError("limit must be positive")
+
+    return {
+        "name": args.get("name") or None,
+        "classid": args.get("classid") or None,
+        "tradable": None if tradable in (None, "") else tradable == "1",
+        "bot": args.get("bot") or None,
+        "server": args.get("server") or None,
+        "sort": sort,
+        "descending": order == "desc",
+        "after": decode_cursor(args["after"]) if args.get("after") else None,
+        "limit": min(limit, int(max_limit))
+    }
+
+
+class InventoryIndex():
+    def __init__(self, snapshot):
+        self.inventory = dict(snapshot.inventory)
+        self.descriptions = dict(snapshot.descriptions)
+        self.records = {}
+        for key, item in self.inventory.items():
+            description_key = self.description_key(item)
+            description = self.descriptions.get(description_key, {})
+            self.records[key] = (
+                (description.get("market_hash_name") or "").lower(),
+                str(item.get("classid", "")),
+                bool(description.get("tradable")),
+                item.get("bot"),
+                item.get("server"),
+                description_key
+            )
+        self.sorted = {
+            "name": sorted([record[0], key] for key, record in self.records.items()),
+            "classid": sorted(numeric_key(record[1]) + [key] for key, record in self.records.items()),
+            "assetid": sorted(numeric_key(self.inventory[key].get("id", key)) + [key] for key in self.records)
+        }
+
+    def description_key(self, item):
+        return "%s_%s" % (item.get("classid"), item.get("instanceid", "0"))
+
+    def query(self, name=None, classid=None, tradable=None, bot=None, server=None, sort="name", descending=False, after=None, limit=30):
+        sort_keys = self.sorted[sort]
+        name = name.lower() if name else None
+
+        if descending:
+            start = len(sort_keys) - 1 if after is None else bisect.bisect_left(sort_keys, after) - 1
+            if name and sort == "name":
+                start = min(start, bisect.bisect_left(sort_keys, [name + u"\uffff"]) - 1)
+            positions = range(start, -1, -1)
+        else:
+            start = 0 if after is None else bisect.bisect_right(sort_keys, after)
+            if name and sort == "name":
+                start = max(start, bisect.bisect_left(sort_keys, [name]))
+            positions = range(start, len(sort_keys))
+
+        order = []
+        inventory = {}
+        descriptions = {}
+        last_key = None
+        for position in positions:
+            sort_key = sort_keys[position]
+            key = sort_key[-1]
+            record = self.records[key]
+            if name and not record[0].startswith(name):
+                if sort == "name":
+                    break
+                continue
+            if classid and record[1] != classid:
+                continue
+            if tradable is not None and record[2] != tradable:
+                continue
+            if bot and record[3] != bot:
+                continue
+            if server and record[4] != server:
+                continue
+            if len(inventory) == limit:
+                return self._page(order, inventory, descriptions, last_key)
+            order.append(key)
+            inventory[key] = self.inventory[key]
+            if record[5] in self.descriptions:
+                descriptions[record[5]] = self.descriptions[record[5]]
+            last_key = sort_key
+        return self._page(order, inventory, descriptions, None)
+
+    def _page(self, order, inventory, descriptions, last_key):
+        return {
+            "order": order,
+            "inventory": inventory,
+            "descriptions": descriptions,
+            "count": len(inventory),
+            "next": encode_cursor(last_key) if last_key is not None else None
+        }
@@ -0,0 +1,125 @@
+import threading
+import datetime
+import json
+import time
+
+
+RECORD_SCRIPT = """
+local ewma = tonumber(ARGV[2])
+local previous = redis.call('HGET', KEYS[3], ARGV[1])
+if previous then
+    ewma = tonumber(ARGV[3]) * ewma + (1 - tonumber(ARGV[3])) * tonumber(previous)
+end
+redis.call('HSET', KEYS[3], ARGV[1], tostring(ewma))
+redis.call('ZADD', KEYS[1], ewma, ARGV[1])
+redis.call('ZADD', KEYS[2], ARGV[4], ARGV[1])
+return tostring(ewma)
+"""
+
+BEST_SCRIPT = """
+local stale = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', '(' .. ARGV[1])
+for _, server_id in ipairs(stale) do
+    redis.call('ZREM', KEYS[1], server_id)
+    redis.call('ZREM', KEYS[2], server_id)
+end
+return redis.call('ZRANGE', KEYS[1], 0, tonumber(ARGV[2]), 'WITHSCORES')
+"""
+
+
+class ServerLoads():
+    def __init__(self, redis, db_servers, token, max_age=300, history_size=60, alpha=0.3, stale_after=90):
+        self.redis = redis
+        self.db_servers = db_servers
+        self.token = token
+        self.max_age = int(max_age)
+        self.history_size = int(history_size)
+        self.alpha = float(alpha)
+        self.stale_after = float(stale_after)
+        self.key = "server_loads"
+        self.seen_key = "server_loads_seen"
+        self.ewma_key = "server_loads_ewma"
+        self.bots_key = "server_loads_bots"
+        self.fresh_key = "server_loads_fresh"
+        self.lock_key = "server_loads_refreshing"
+        self.record_script = redis.register_script(RECORD_SCRIPT)
+        self.best_script = redis.register_script(BEST_SCRIPT)
+
+    def history_key(self, server_id):
+        return "server_load_history_%s" % server_id
+
+    def observe(self, server_id, server_stats, response_time):
+        server_id = str(server_id)
+        now = time.time()
+        sample = {"time": now, "response_time": response_time, "success": server_stats.get("success", False)}
+        if sample["success"]:
+            sample["ewma"] = float(self.record_script(
+                keys=[self.key, self.seen_key, self.ewma_key],
+                args=[server_id, float(server_stats["load"]), self.alpha, now]
+            ))
+            sample["load"] = float(server_stats["load"])
+            sample["bots"] = len(server_stats["bots"])
+        else:
+            self.remove(server_id)
+
+        pipe = self.redis.pipeline(transaction=False)
+        if sample["success"]:
+            pipe.hset(self.bots_key, server_id, sample["bots"])
+        pipe.lpush(self.history_key(server_id), json.dumps(sample))
+        pipe.ltrim(self.history_key(server_id), 0, self.history_size - 1)
+        pipe.execute()
+        return sample
+
+    def remove(self, server_id):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zrem(self.key, str(server_id))
+        pipe.zrem(self.seen_key, str(server_id))
+        pipe.hdel(self.ewma_key, str(server_id))
+        pipe.hdel(self.bots_key, str(server_id))
+        pipe.execute()
+
+    def history(self, server_id):
+        history = []
+        for sample in self.redis.lrange(self.history_key(server_id), 0, -1):
+            sample = json.loads(sample)
+            sample["time"] = datetime.datetime.utcfromtimestamp(sample["time"])
+            history.append(sample)
+        return history
+
+    def mark_fresh(self):
+        self.redis.set(self.fresh_key, 1, ex=self.max_age)
+
+    def ranked(self, stop=-1):
+        pipe = self.redis.pipeline(transaction=False)
+        self.best_script(keys=[self.key, self.seen_key], args=[time.time() - self.stale_after, stop], client=pipe)
+        pipe.exists(self.fresh_key)
+        pipe.hgetall(self.bots_key)
+        loads, fresh, bots = pipe.execute()
+        if not fresh:
+            self.refresh_async()
+        bots = dict((self._decode(server_id), int(count)) for server_id, count in bots.items())
+        ranked = []
+        for server_id, load in zip(loads[::2], loads[1::2]):
+            server_id = self._decode(server_id)
+            ranked.append((server_id, float(load), bots.get(server_id, 1)))
+        return ranked
+
+    def _decode(self, value):
+        if isinstance(value, bytes):
+            return value.decode("utf-8")
+        return value
+
+    def refresh_async(self):
+        if self.redis.set(self.lock_key, 1, ex=60, nx=True):
+            thread = threading.Thread(target=self.refresh)
+            thread.daemon = True
+            thread.start()
+
+    def refresh(self):
+        try:
+            for server in self.db_servers.get_all():
+                started = time.time()
+                server_stats = self.db_servers.fetch_server_stats(server["host"], server["port"], self.token)
+                self.observe(server["_id"], server_stats, time.time() - started)
+            self.mark_fresh()
+        finally:
+            self.redis.delete(self.lock_key)
@@ -0,0 +1,63 @@
+from pymongo import UpdateOne, DeleteOne, ASCENDING
+import datetime
+
+
+class DatabaseAssetLocations():
+    indexes = [
+        {"keys": [("server_id", ASCENDING), ("bot", ASCENDING), ("app_id", ASCENDING), ("updated", ASCENDING)]}
+    ]
+
+    def __init__(self, db):
+        self.collection = db["asset_locations"]
+
+    def query_shapes(self):
+        return [
+            {"filter": {"_id": {"$in": ["730_1", "730_2"]}}},
+            {"filter": {"server_id": "0", "bot": "bot", "app_id": 730, "updated": {"$lt": datetime.datetime.utcnow()}}}
+        ]
+
+    def key(self, app_id, assetid):
+        return "%s_%s" % (int(app_id), assetid)
+
+    def set_bot_assets(self, server_id, bot_username, app_id, inventory):
+        datetime_now = datetime.datetime.utcnow()
+        operations = [self._upsert(server_id, bot_username, app_id, assetid, item, datetime_now) for assetid, item in inventory.items()]
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+        self.collection.delete_many({
+            "server_id": str(server_id),
+            "bot": str(bot_username),
+            "app_id": int(app_id),
+            "updated": {"$lt": datetime_now}
+        })
+
+    def apply_delta(self, server_id, bot_username, app_id, added, removed):
+        datetime_now = datetime.datetime.utcnow()
+        operations = [self._upsert(server_id, bot_username, app_id, assetid, item, datetime_now) for assetid, item in added.items()]
+        for assetid in removed:
+            operations.append(DeleteOne({"_id": self.key(app_id, assetid), "server_id": str(server_id), "bot": str(bot_username)}))
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+
+    def locate(self, asset_keys):
+        asset_keys = list(set((int(app_id), str(assetid)) for app_id, assetid in asset_keys))
+        if not asset_keys:
+            return {}
+        locations = {}
+        for location in self.collection.find({"_id": {"$in": [self.key(app_id, assetid) for app_id, assetid in asset_keys]}}):
+            locations[(location["app_id"], location["assetid"])] = location
+        return locations
+
+    def _upsert(self, server_id, bot_username, app_id, assetid, item, datetime_now):
+        return UpdateOne(
+            {"_id": self.key(app_id, assetid)},
+            {"$set": {
+                "app_id": int(app_id),
+                "assetid": str(assetid),
+                "server_id": str(server_id),
+                "bot": str(bot_username),
+                "points": item.get("points") if isinstance(item, dict) else None,
+                "updated": datetime_now
+            }},
+            upsert=True
+        )
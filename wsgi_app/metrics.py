@@ -0,0 +1,220 @@
+from contextlib import contextmanager
+import threading
+import bisect
+import time
+
+
+timer = getattr(time, "perf_counter", time.time)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class RequestTimings():
+    def __init__(self):
+        self.started = timer()
+        self.total = None
+        self.spans = {}
+        self.lock = threading.Lock()
+
+    def add(self, dependency, seconds):
+        with self.lock:
+            self.spans[dependency] = self.spans.get(dependency, 0.0) + seconds
+
+    def server_timing(self):
+        entries = ["%s;dur=%.2f" % (dependency, seconds * 1000) for dependency, seconds in sorted(self.spans.items())]
+        if self.total is not None:
+            entries.append("total;dur=%.2f" % (self.total * 1000))
+        return ", ".join(entries)
+
+
+class Histogram():
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics():
+    def __init__(self, buckets=None, prefix="trade_api"):
+        self.buckets = tuple(sorted(float(bucket) for bucket in (buckets or DEFAULT_BUCKETS)))
+        self.prefix = prefix
+        self.routes = {}
+        self.dependencies = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def current(self):
+        return getattr(self.local, "timings", None)
+
+    def bind(self, timings):
+        previous = self.current()
+        self.local.timings = timings
+        return previous
+
+    def bound(self, func):
+        timings = self.current()
+
+        def wrapper(*args, **kwargs):
+            previous = self.bind(timings)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.bind(previous)
+        return wrapper
+
+    def start_request(self):
+        timings = RequestTimings()
+        self.bind(timings)
+        return timings
+
+    def finish_request(self, method, route, status):
+        timings = self.current()
+        if timings is None:
+            return None
+        self.bind(None)
+        timings.total = timer() - timings.started
+        self._observe(self.routes, (method, route, str(status)), timings.total)
+        return timings
+
+    def observe_dependency(self, dependency, operation, seconds):
+        self._observe(self.dependencies, (dependency, operation), seconds)
+        timings = self.current()
+        if timings is not None:
+            timings.add(dependency, seconds)
+
+    @contextmanager
+    def span(self, dependency, operation):
+        started = timer()
+        try:
+            yield
+        finally:
+            self.observe_dependency(dependency, operation, timer() - started)
+
+    def _observe(self, histograms, labels, seconds):
+        with self.lock:
+            histogram = histograms.get(labels)
+            if histogram is None:
+                histogram = histograms[labels] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            self._render(lines, "%s_request_seconds" % self.prefix, ("method", "route", "status"), self.routes)
+            self._render(lines, "%s_dependency_seconds" % self.prefix, ("dependency", "operation"), self.dependencies)
+        return "\n".join(lines) + "\n"
+
+    def _render(self, lines, name, label_names, histograms):
+        lines.append("# TYPE %s histogram" % name)
+        for labels in sorted(histograms.keys()):
+            histogram = histograms[labels]
+            label_text = ",".join('%s="%s"' % (label_name, str(label).replace("\\", "\\\\").replace('"', '\\"')) for label_name, label in zip(label_names, labels))
+            cumulative = 0
+            for bucket, count in zip(self.buckets + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append('%s_bucket{%s,le="%s"} %d' % (name, label_text, bucket, cumulative))
+            lines.append("%s_sum{%s} %f" % (name, label_text, histogram.sum))
+            lines.append("%s_count{%s} %d" % (name, label_text, histogram.count))
+
+
+class TimedDatabase():
+    def __init__(self, db, metrics):
+        self.db = db
+        self.metrics = metrics
+
+    def __getitem__(self, name):
+        return TimedCollection(self.db[name], self.metrics)
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+
+class TimedCollection():
+    def __init__(self, collection, metrics):
+        self.collection = collection
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        attribute = getattr(self.collection, name)
+        if not callable(attribute):
+            return attribute
+        operation = "%s.%s" % (self.collection.name, name)
+
+        def timed(*args, **kwargs):
+            started = timer()
+            result = attribute(*args, **kwargs)
+            if hasattr(result, "next") and not isinstance(result, dict):
+                return TimedCursor(result, self.metrics, operation, timer() - started)
+            self.metrics.observe_dependency("mongo", operation, timer() - started)
+            return result
+        return timed
+
+
+class TimedCursor():
+    def __init__(self, cursor, metrics, operation, elapsed=0.0):
+        self.cursor = cursor
+        self.metrics = metrics
+        self.operation = operation
+        self.elapsed = elapsed
+        self.observed = False
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        started = timer()
+        try:
+            document = next(self.cursor)
+        except StopIteration:
+            self.elapsed += timer() - started
+            self.finish()
+            raise
+        self.elapsed += timer() - started
+        return document
+
+    __next__ = next
+
+    def finish(self):
+        if not self.observed:
+            self.observed = True
+            self.metrics.observe_dependency("mongo", self.operation, self.elapsed)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.cursor, name)
+        if not callable(attribute):
+            return attribute
+
+        def chained(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            return self if result is self.cursor else result
+        return chained
+
+
+def instrument_redis(redis, metrics):
+    execute_command = redis.execute_command
+    pipeline = redis.pipeline
+
+    def timed_execute_command(*args, **options):
+        command = args[0].decode("utf-8") if isinstance(args[0], bytes) else str(args[0])
+        with metrics.span("redis", command.upper()):
+            return execute_command(*args, **options)
+
+    def timed_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        def timed_execute(*args, **kwargs):
+            with metrics.span("redis", "PIPELINE"):
+                return execute(*args, **kwargs)
+        pipe.execute = timed_execute
+        return pipe
+
+    redis.execute_command = timed_execute_command
+    redis.pipeline = timed_pipeline
+    return redis
@@ -0,0 +1,117 @@
+import gzip
+import json
+import zlib
+import io
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+JSON_MIMETYPE = "application/json"
+MSGPACK_MIMETYPE = "application/msgpack"
+MSGPACK_MIMETYPES = (MSGPACK_MIMETYPE, "application/x-msgpack")
+
+DYNAMIC_LEVELS = {"gzip": 6, "br": 4}
+CACHED_LEVELS = {"gzip": 9, "br": 9}
+
+
+def negotiate_mimetype(accept_mimetypes):
+    if msgpack is None:
+        return JSON_MIMETYPE
+    mimetype = accept_mimetypes.best_match((JSON_MIMETYPE,) + MSGPACK_MIMETYPES, default=JSON_MIMETYPE)
+    return MSGPACK_MIMETYPE if mimetype in MSGPACK_MIMETYPES else JSON_MIMETYPE
+
+
+def negotiate_encoding(accept_encodings, enabled=True, streaming=False):
+    if not enabled:
+        return None
+    encodings = ["gzip"] if streaming or brotli is None else ["br", "gzip"]
+    return accept_encodings.best_match(encodings)
+
+
+def stream_requested(value, default=False):
+    if value is None:
+        return default
+    return value.lower() in ("1", "true")
+
+
+def negotiate_inventory(accept_mimetypes, accept_encodings, stream=False, enabled=True):
+    mimetype = negotiate_mimetype(accept_mimetypes)
+    streaming = bool(stream) and mimetype == JSON_MIMETYPE
+    encoding = negotiate_encoding(accept_encodings, enabled, streaming)
+    return mimetype, streaming, encoding
+
+
+def finish_inventory_response(response, etag, encoding):
+    if encoding and response.status_code == 200:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept")
+    response.vary.add("Accept-Encoding")
+    response.set_etag(etag)
+    return response
+
+
+def response_encoding(response, accept_encodings, enabled=True):
+    if response.mimetype != JSON_MIMETYPE and response.mimetype not in MSGPACK_MIMETYPES:
+        return None
+    response.vary.add("Accept")
+    if response.status_code != 200 or "Content-Encoding" in response.headers:
+        return None
+    return negotiate_encoding(accept_encodings, enabled)
+
+
+def set_compressed_body(response, body, encoding):
+    response.set_data(compress(body, encoding))
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def representation_tag(mimetype, encoding):
+    tag = ""
+    if mimetype == MSGPACK_MIMETYPE:
+        tag += "-msgpack"
+    if encoding:
+        tag += "-%s" % encoding
+    return tag
+
+
+def _msgpack_default(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def serialize(payload, mimetype):
+    if mimetype == MSGPACK_MIMETYPE:
+        return msgpack.packb(payload, use_bin_type=True, default=_msgpack_default)
+    return json.dumps(payload).encode("utf-8")
+
+
+def compress(body, encoding, levels=DYNAMIC_LEVELS):
+    if encoding == "gzip":
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=levels["gzip"], mtime=0) as gzip_file:
+            gzip_file.write(body)
+        return buffer.getvalue()
+    if encoding == "br":
+        return brotli.compress(body, quality=levels["br"])
+    return body
+
+
+def compress_stream(chunks, level=DYNAMIC_LEVELS["gzip"]):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode("utf-8")
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,92 @@
+from dispatch import Dispatcher
+import threading
+import datetime
+import logging
+import json
+import time
+import os
+
+
+logger = logging.getLogger(__name__)
+
+
+class ServerPoller():
+    def __init__(self, redis, db_servers, server_loads, token, interval=30, workers=8):
+        self.redis = redis
+        self.db_servers = db_servers
+        self.server_loads = server_loads
+        self.token = token
+        self.interval = int(interval)
+        self.dispatcher = Dispatcher(workers)
+        self.lock_key = "server_poller_lock"
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def key(self, server_id):
+        return "server_state_%s" % server_id
+
+    def start(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.dispatcher = Dispatcher(self.dispatcher.workers)
+            thread = threading.Thread(target=self.run)
+            thread.daemon = True
+            thread.start()
+
+    def run(self):
+        while True:
+            try:
+                if self.redis.set(self.lock_key, self.pid, ex=self.interval, nx=True):
+                    self.poll_all()
+            except Exception:
+                logger.exception("Server poll failed")
+            time.sleep(self.interval)
+
+    def poll_all(self):
+        servers = self.db_servers.get_all()
+        self.dispatcher.map(self.poll_server, [(server,) for server in servers])
+        self.server_loads.mark_fresh()
+
+    def poll_async(self, server):
+        thread = threading.Thread(target=self.poll_server, args=(server,))
+        thread.daemon = True
+        thread.start()
+
+    def poll_server(self, server):
+        started = time.time()
+        server_stats = self.db_servers.fetch_server_stats(server["host"], server["port"], self.token)
+        now = time.time()
+        self.server_loads.observe(server["_id"], server_stats, now - started)
+        state = {"status": 1 if server_stats.get("success", False) else 0, "checked": now}
+        if state["status"]:
+            state["load"] = server_stats["load"]
+            state["bots"] = json.dumps(server_stats["bots"])
+            state["last_seen"] = now
+        self.redis.hset(self.key(server["_id"]), mapping=state)
+        return state
+
+    def forget(self, server_id):
+        self.redis.delete(self.key(server_id))
+
+    def get(self, server_id):
+        return self.get_many([server_id])[server_id]
+
+    def get_many(self, server_ids):
+        pipe = self.redis.pipeline(transaction=False)
+        for server_id in server_ids:
+            pipe.hgetall(self.key(server_id))
+        return dict(zip(server_ids, [self._decode(state) for state in pipe.execute()]))
+
+    def _decode(self, state):
+        state = dict((k.decode("utf-8") if isinstance(k, bytes) else k, v) for k, v in state.items())
+        return {
+            "status": state.get("status") in (b"1", "1"),
+            "load": float(state["load"]) if "load" in state else None,
+            "bots": json.loads(state["bots"]) if "bots" in state else None,
+            "last_seen": datetime.datetime.utcfromtimestamp(float(state["last_seen"])) if "last_seen" in state else None,
+            "checked": datetime.datetime.utcfromtimestamp(float(state["checked"])) if "checked" in state else None
+        }
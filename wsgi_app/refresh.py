@@ -0,0 +1,110 @@
+import threading
+import logging
+import time
+import os
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+
+logger = logging.getLogger(__name__)
+
+
+class InventoryRefreshQueue():
+    def __init__(self, db_servers, db_inventories, inventory_snapshots, token, workers=4):
+        self.db_servers = db_servers
+        self.db_inventories = db_inventories
+        self.inventory_snapshots = inventory_snapshots
+        self.token = token
+        self.workers = int(workers)
+        self.jobs = Queue()
+        self.pending = {}
+        self.running = set()
+        self.dirty = set()
+        self.stats = {"enqueued": 0, "coalesced": 0, "completed": 0, "failed": 0, "last_latency": None, "total_latency": 0.0}
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.jobs = Queue()
+            self.running = set()
+            self.dirty = set()
+            for key in self.pending:
+                self.jobs.put(key)
+            for i in range(self.workers):
+                thread = threading.Thread(target=self.run)
+                thread.daemon = True
+                thread.start()
+
+    def enqueue(self, server, bot_username, app_id):
+        self.start()
+        key = (server["_id"], bot_username, int(app_id))
+        with self.lock:
+            if key in self.pending:
+                self.stats["coalesced"] += 1
+                return False
+            if key in self.running:
+                self.dirty.add(key)
+                self.stats["coalesced"] += 1
+                return False
+            self.pending[key] = (server, time.time())
+            self.stats["enqueued"] += 1
+            self.jobs.put(key)
+        return True
+
+    def run(self):
+        jobs = self.jobs
+        while True:
+            key = jobs.get()
+            with self.lock:
+                server, enqueued = self.pending.pop(key)
+                self.running.add(key)
+
+            success = False
+            try:
+                success = self.refresh(server, key[1], key[2])
+            except Exception:
+                logger.exception("Inventory refresh of %s failed", key)
+
+            with self.lock:
+                self.running.discard(key)
+                latency = time.time() - enqueued
+                self.stats["completed" if success else "failed"] += 1
+                self.stats["last_latency"] = latency
+                self.stats["total_latency"] += latency
+                requeue = key in self.dirty
+                self.dirty.discard(key)
+            if requeue:
+                self.enqueue(server, key[1], key[2])
+
+    def refresh(self, server, bot_username, app_id):
+        response = self.db_servers.request_inventory(server["host"], server["port"], bot_username, app_id, self.token)
+        if not response.get("success", False):
+            return False
+        result = self.db_inventories.set_inventory(
+            server["_id"],
+            bot_username,
+            app_id,
+            {"inventory": response["inventory"], "descriptions": response["descriptions"]}
+        )
+        if result:
+            self.inventory_snapshots.touch(app_id, server["_id"], bot_username)
+        return result
+
+    def status(self):
+        with self.lock:
+            status = dict(self.stats)
+            status["depth"] = len(self.pending)
+            status["running"] = len(self.running)
+        finished = status["completed"] + status["failed"]
+        total_latency = status.pop("total_latency")
+        status["average_latency"] = total_latency / finished if finished else None
+        return status
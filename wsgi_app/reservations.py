@@ -0,0 +1,67 @@
+import time
+
+
+RESERVE_SCRIPT = """
+local count = tonumber(ARGV[1])
+local now = tonumber(ARGV[2])
+local ttl = tonumber(ARGV[3])
+for i = 1, count do
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        return i
+    end
+end
+for i = 1, count do
+    redis.call('SET', KEYS[i], 1, 'EX', ttl)
+    redis.call('ZADD', KEYS[count + i], now + ttl, KEYS[i])
+    redis.call('EXPIRE', KEYS[count + i], ttl)
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+local count = tonumber(ARGV[1])
+for i = 1, count do
+    redis.call('DEL', KEYS[i])
+    redis.call('ZREM', KEYS[count + i], KEYS[i])
+end
+return count
+"""
+
+
+class AssetReservations():
+    def __init__(self, redis, ttl=320):
+        self.redis = redis
+        self.ttl = int(ttl)
+        self.reserve_script = redis.register_script(RESERVE_SCRIPT)
+        self.release_script = redis.register_script(RELEASE_SCRIPT)
+
+    def key(self, server_id, bot_username, app_id, assetid):
+        return "reserved_%s_%s_%s_%s" % (server_id, bot_username, app_id, assetid)
+
+    def bot_key(self, server_id, bot_username):
+        return "reservations_%s_%s" % (server_id, bot_username)
+
+    def reserve(self, reservations):
+        keys = [self.key(*reservation) for reservation in reservations]
+        if len(set(keys)) != len(keys):
+            return False
+        bot_keys = [self.bot_key(reservation[0], reservation[1]) for reservation in reservations]
+        conflict = self.reserve_script(keys=keys + bot_keys, args=[len(keys), int(time.time()), self.ttl])
+        return int(conflict) == 0
+
+    def release(self, reservations):
+        if not reservations:
+            return 0
+        keys = [self.key(*reservation) for reservation in reservations]
+        bot_keys = [self.bot_key(reservation[0], reservation[1]) for reservation in reservations]
+        return self.release_script(keys=keys + bot_keys, args=[len(keys)])
+
+    def reserved_counts(self, server_id, bot_usernames):
+        now = int(time.time())
+        pipe = self.redis.pipeline(transaction=False)
+        for bot_username in bot_usernames:
+            bot_key = self.bot_key(server_id, bot_username)
+            pipe.zremrangebyscore(bot_key, "-inf", now)
+            pipe.zcard(bot_key)
+        results = pipe.execute()
+        return dict(zip(bot_usernames, results[1::2]))
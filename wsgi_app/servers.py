@@ -1,29 +1,47 @@
-import requests
-import json
+from upstream import UpstreamClient, UPSTREAM_ERRORS
 from bson.objectid import ObjectId
+from pymongo import ASCENDING
+import threading
+import logging
+import json
+import time
+
+
+logger = logging.getLogger(__name__)
 
 
 class DatabaseServers():
-    def __init__(self, db):
+    indexes = [
+        {"keys": [("host", ASCENDING)]}
+    ]
+
+    def __init__(self, db, upstream=None, cache_ttl=60):
         self.collection = db["servers"]
+        self.upstream = upstream or UpstreamClient()
+        self.cache_ttl = float(cache_ttl)
+        self.registry = None
+        self.registry_expires = 0
+        self.lock = threading.Lock()
+
+    def query_shapes(self):
+        return [
+            {"filter": {"host": "127.0.0.1"}}
+        ]
 
     def get_all(self):
-        db_servers = list(self.collection.find({}))
-        for server in db_servers:
-            server["_id"] = str(server["_id"])
-        return db_servers
+        return [dict(server) for server in self._registry()[0]]
 
     def get(self, server_id):
-        db_server = self.collection.find_one({"_id": ObjectId(server_id)})
+        db_server = self._registry()[1].get(str(server_id))
         if db_server:
-            db_server["_id"] = str(db_server["_id"])
-        return db_server
+            return dict(db_server)
+        return None
 
     def get_host(self, server_host):
-        db_server = self.collection.find_one({"host": server_host})
+        db_server = self._registry()[2].get(server_host)
         if db_server:
-            db_server["_id"] = str(db_server["_id"])
-        return db_server
+            return dict(db_server)
+        return None
 
     def add(self, name, host, port):
         new_server = {
@@ -31,117 +49,158 @@ class DatabaseServers():
             "host": host,
             "port": port
         }
-        result = self.collection.insert(new_server)
-        return result is not None
+        result = self.collection.insert_one(new_server)
+        self.invalidate()
+        if result.inserted_id is None:
+            return None
+        return str(result.inserted_id)
+
+    def remove(self, server_id):
+        result = self.collection.delete_one({"_id": ObjectId(server_id)})
+        self.invalidate()
+        return result.deleted_count == 1
+
+    def invalidate(self):
+        with self.lock:
+            self.registry = None
+
+    def _registry(self):
+        registry = self.registry
+        if registry is None or time.time() >= self.registry_expires:
+            with self.lock:
+                if self.registry is None or time.time() >= self.registry_expires:
+                    servers = list(self.collection.find({}))
+                    servers_by_id = {}
+                    servers_by_host = {}
+                    for server in servers:
+                        server["_id"] = str(server["_id"])
+                        servers_by_id[server["_id"]] = server
+                        servers_by_host.setdefault(server["host"], server)
+                    self.registry = (servers, servers_by_id, servers_by_host)
+                    self.registry_expires = time.time() + self.cache_ttl
+                registry = self.registry
+        return registry
 
     def add_bot(self,  host, port, bot_json, token):
         post_data = bot_json
         post_data["token"] = token
         try:
-            response = requests.post("http://%s:%s/bots/add" % (str(host), int(port)), data=post_data, timeout=120)
+            response = self.upstream.post("add_bot", host, port, "/bots/add", data=post_data)
             if response.status_code == 200:
                 return True
-        except:
-            pass
+        except UPSTREAM_ERRORS as e:
+            logger.warning("Adding bot on %s:%s failed: %s", host, port, e)
         return False
 
     def toggle_bot(self,  host, port, bot_username, token):
         post_data = {"username": bot_username, "token": token}
         try:
-            response = requests.post("http://%s:%s/bots/toggle" % (str(host), int(port)), data=post_data, timeout=20)
+            response = self.upstream.post("toggle_bot", host, port, "/bots/toggle", data=post_data)
             if response.status_code == 200:
                 return True
-        except:
-            pass
+        except UPSTREAM_ERRORS as e:
+            logger.warning("Toggling bot %s on %s:%s failed: %s", bot_username, host, port, e)
         return False
 
     def remove_bot(self,  host, port, bot_username, token):
         post_data = {"username": bot_username, "token": token}
         try:
-            response = requests.post("http://%s:%s/bots/remove" % (str(host), int(port)), data=post_data, timeout=20)
+            response = self.upstream.post("remove_bot", host, port, "/bots/remove", data=post_data)
             if response.status_code == 200:
                 return True
-        except:
-            pass
+        except UPSTREAM_ERRORS as e:
+            logger.warning("Removing bot %s on %s:%s failed: %s", bot_username, host, port, e)
         return False
 
     def ping(self, host, port, token):
         try:
-            response = requests.get("http://%s:%s/ping?token=%s" % (str(host), int(port), token), timeout=20)
+            response = self.upstream.get("ping", host, port, "/ping", params={"token": token})
             if response.status_code == 200:
                 return True
-        except:
-            pass
+        except UPSTREAM_ERRORS as e:
+            logger.warning("Ping %s:%s failed: %s", host, port, e)
         return False
 
-    def deposit(self, server_id, steam_id, trade_token, assets, report_url, additional, token):
-        data = {"success": False}
-        db_server = self.get(server_id)
+    def deposit(self, server_id, steam_id, trade_token, assets, report_url, additional, token, db_server=None):
+        if db_server is None:
+            db_server = self.get(server_id)
+        if not db_server:
+            logger.warning("Deposit for %s skipped: unknown server %s", steam_id, server_id)
+            return {"success": False}
         try:
-            post_data = {
-                "steam_id": steam_id,
-                "trade_token": trade_token,
-                "assets": json.dumps(assets),
-                "data": json.dumps(additional),
-                "report_url": report_url,
-                "token": token
-            }
-            response = requests.post("http://%s:%s/deposit" % (str(db_server["host"]), int(db_server["port"])), data=post_data, timeout=20)
-            if response.status_code == 200:
-                response_json = response.json()
-                data["success"] = True
-                data["security_code"] = response_json["security_code"]
-                data["task_id"] = response_json["task_id"]
-                data["bot"] = response_json["bot"]
-        except:
-            pass
-        return data
+            post_data = self.trade_post_data(steam_id, trade_token, assets, report_url, additional, token)
+            response = self.upstream.post("deposit", db_server["host"], db_server["port"], "/deposit", data=post_data)
+            return self.trade_result(response, "Deposit for %s on server %s" % (steam_id, server_id))
+        except UPSTREAM_ERRORS as e:
+            logger.warning("Deposit for %s on server %s failed: %s", steam_id, server_id, e)
+        return {"success": False}
 
-    def withdraw(self, server_id, steam_id, trade_token, assets, bot, report_url, additional, token):
-        data = {"success": False}
-        db_server = self.get(server_id)
+    def withdraw(self, server_id, steam_id, trade_token, assets, bot, report_url, additional, token, db_server=None):
+        if db_server is None:
+            db_server = self.get(server_id)
+        if not db_server:
+            logger.warning("Withdrawal for %s skipped: unknown server %s", steam_id, server_id)
+            return {"success": False}
         try:
-            post_data = {
-                "steam_id": steam_id,
-                "trade_token": trade_token,
-                "assets": json.dumps(assets),
-                "data": json.dumps(additional),
-                "report_url": report_url,
-                "token": token
-            }
-            response = requests.post("http://%s:%s/%s/withdraw" % (str(db_server["host"]), int(db_server["port"]), str(bot)), data=post_data, timeout=20)
-            if response.status_code == 200:
-                response_json = response.json()
-                data["success"] = True
-                data["security_code"] = response_json["security_code"]
-                data["task_id"] = response_json["task_id"]
-                data["bot"] = response_json["bot"]
-        except:
-            pass
-        return data
+            post_data = self.trade_post_data(steam_id, trade_token, assets, report_url, additional, token)
+            response = self.upstream.post("withdraw", db_server["host"], db_server["port"], "/%s/withdraw" % str(bot), data=post_data)
+            return self.trade_result(response, "Withdrawal for %s from %s on server %s" % (steam_id, bot, server_id))
+        except UPSTREAM_ERRORS as e:
+            logger.warning("Withdrawal for %s from %s on server %s failed: %s", steam_id, bot, server_id, e)
+        return {"success": False}
 
     def fetch_server_stats(self, host, port, token):
-        data = {"success": False}
         try:
-            response = requests.get("http://%s:%s/stats?token=%s" % (str(host), int(port), token), timeout=5)
-            if response.status_code == 200:
-                response_json = response.json()
-                data["success"] = True
-                data["load"] = float(response_json["load"])
-                data["bots"] = response_json["bots"]
-        except:
-            pass
-        return data
+            response = self.upstream.get("stats", host, port, "/stats", params={"token": token})
+            return self.stats_result(response)
+        except UPSTREAM_ERRORS as e:
+            logger.warning("Fetching stats from %s:%s failed: %s", host, port, e)
+        return {"success": False}
 
     def request_inventory(self, host, port, bot_username, app_id, token):
-        data = {"success": False}
         try:
-            response = requests.get("http://%s:%s/bots/%s/inventory/%s?token=%s" % (str(host), int(port), bot_username, app_id, token), timeout=300)
-            if response.status_code == 200:
-                response_json = response.json()
-                data["success"] = True
-                data["inventory"] = response_json["inventory"]
-                data["descriptions"] = response_json["descriptions"]
-        except:
-            pass
-        return data
\ No newline at end of file
+            response = self.upstream.get("inventory", host, port, "/bots/%s/inventory/%s" % (bot_username, app_id), params={"token": token})
+            return self.inventory_result(response)
+        except UPSTREAM_ERRORS as e:
+            logger.warning("Fetching %s inventory of %s from %s:%s failed: %s", app_id, bot_username, host, port, e)
+        return {"success": False}
+
+    def trade_post_data(self, steam_id, trade_token, assets, report_url, additional, token):
+        return {
+            "steam_id": steam_id,
+            "trade_token": trade_token,
+            "assets": json.dumps(assets),
+            "data": json.dumps(additional),
+            "report_url": report_url,
+            "token": token
+        }
+
+    def trade_result(self, response, description):
+        data = {"success": False}
+        if response.status_code == 200:
+            response_json = response.json()
+            data["security_code"] = response_json["security_code"]
+            data["task_id"] = response_json["task_id"]
+            data["bot"] = response_json["bot"]
+            data["success"] = True
+        else:
+            logger.warning("%s returned %s", description, response.status_code)
+        return data
+
+    def stats_result(self, response):
+        data = {"success": False}
+        if response.status_code == 200:
+            response_json = response.json()
+            data["load"] = float(response_json["load"])
+            data["bots"] = response_json["bots"]
+            data["success"] = True
+        return data
+
+    def inventory_result(self, response):
+        data = {"success": False}
+        if response.status_code == 200:
+            response_json = response.json()
+            data["inventory"] = response_json["inventory"]
+            data["descriptions"] = response_json["descriptions"]
+            data["success"] = True
+        return data
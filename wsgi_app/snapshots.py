@@ -0,0 +1,216 @@
+from inventory_index import InventoryIndex
+from negotiation import JSON_MIMETYPE, CACHED_LEVELS, serialize, compress
+import threading
+import json
+
+
+BUMP_SCRIPT = """
+local version = redis.call('INCR', KEYS[1])
+redis.call('HSET', KEYS[2], ARGV[1], version)
+return version
+"""
+
+
+class InventorySnapshot():
+    def __init__(self, app_id, version):
+        self.app_id = int(app_id)
+        self.version = version
+        self.inventory = {}
+        self.descriptions = {}
+        self.description_refs = {}
+        self.bots = {}
+        self.body = None
+        self.search_index = None
+        self.encoded_bodies = {}
+        self.encode_locks = {}
+        self.lock = threading.Lock()
+
+    @property
+    def etag(self):
+        return "%s-%s" % (self.app_id, self.version)
+
+    def copy(self, version):
+        snapshot = InventorySnapshot(self.app_id, version)
+        snapshot.inventory = dict(self.inventory)
+        snapshot.descriptions = dict(self.descriptions)
+        snapshot.description_refs = dict(self.description_refs)
+        snapshot.bots = dict(self.bots)
+        return snapshot
+
+    def remove_bot(self, bot_key):
+        inventory_keys, description_keys = self.bots.pop(bot_key, ([], []))
+        for key in inventory_keys:
+            self.inventory.pop(key, None)
+        for key in description_keys:
+            refs = self.description_refs.get(key, 0) - 1
+            if refs > 0:
+                self.description_refs[key] = refs
+            else:
+                self.description_refs.pop(key, None)
+                self.descriptions.pop(key, None)
+        self.body = None
+        self.search_index = None
+        self.encoded_bodies = {}
+
+    def set_bot(self, bot_key, crypted_bot, crypted_server, inventory, descriptions):
+        self.remove_bot(bot_key)
+        inventory_keys = []
+        for key, item in inventory.items():
+            item["bot"] = crypted_bot
+            item["server"] = crypted_server
+            inventory_key = "%s_%s" % (key, crypted_bot)
+            self.inventory[inventory_key] = item
+            inventory_keys.append(inventory_key)
+        for key, description in descriptions.items():
+            self.descriptions[key] = description
+            self.description_refs[key] = self.description_refs.get(key, 0) + 1
+        self.bots[bot_key] = (inventory_keys, list(descriptions.keys()))
+        self.body = None
+        self.search_index = None
+        self.encoded_bodies = {}
+
+    def payload(self):
+        return {
+            "inventory": self.inventory,
+            "descriptions": self.descriptions,
+            "empty": len(self.inventory) == 0
+        }
+
+    def to_json(self):
+        if self.body is None:
+            with self._encode_lock("json"):
+                if self.body is None:
+                    self.body = json.dumps(self.payload())
+        return self.body
+
+    def encoded(self, mimetype, encoding):
+        if mimetype == JSON_MIMETYPE and not encoding:
+            return self.to_json()
+        key = (mimetype, encoding)
+        body = self.encoded_bodies.get(key)
+        if body is None:
+            with self._encode_lock(key):
+                body = self.encoded_bodies.get(key)
+                if body is None:
+                    body = self.to_json().encode("utf-8") if mimetype == JSON_MIMETYPE else serialize(self.payload(), mimetype)
+                    body = compress(body, encoding, CACHED_LEVELS)
+                    self.encoded_bodies[key] = body
+        return body
+
+    def search(self):
+        if self.search_index is None:
+            with self._encode_lock("index"):
+                if self.search_index is None:
+                    self.search_index = InventoryIndex(self)
+        return self.search_index
+
+    def _encode_lock(self, key):
+        with self.lock:
+            return self.encode_locks.setdefault(key, threading.Lock())
+
+
+class InventorySnapshots():
+    def __init__(self, db_inventories, redis, token_codec):
+        self.db_inventories = db_inventories
+        self.redis = redis
+        self.token_codec = token_codec
+        self.snapshots = {}
+        self.lock = threading.Lock()
+        self.bump_script = redis.register_script(BUMP_SCRIPT)
+
+    def version_key(self, app_id):
+        return "inventory_version_%s" % int(app_id)
+
+    def changes_key(self, app_id):
+        return "inventory_changes_%s" % int(app_id)
+
+    def version(self, app_id):
+        return int(self.redis.get(self.version_key(app_id)) or 0)
+
+    def etag(self, app_id, version):
+        return "%s-%s" % (int(app_id), version)
+
+    def touch(self, app_id, server_id, bot_username):
+        bot_key = "%s_%s" % (server_id, bot_username)
+        return self.bump_script(keys=[self.version_key(app_id), self.changes_key(app_id)], args=[bot_key])
+
+    def get(self, app_id):
+        app_id = int(app_id)
+        snapshot = self.snapshots.get(app_id)
+        if snapshot and snapshot.version == self.version(app_id):
+            return snapshot
+
+        with self.lock:
+            pipe = self.redis.pipeline()
+            pipe.get(self.version_key(app_id))
+            pipe.hgetall(self.changes_key(app_id))
+            version, changes = pipe.execute()
+            version = int(version or 0)
+
+            snapshot = self.snapshots.get(app_id)
+            if snapshot is None:
+                snapshot = self._build(app_id, version)
+            elif snapshot.version != version:
+                snapshot = self._update(snapshot, version, changes)
+            self.snapshots[app_id] = snapshot
+        return snapshot
+
+    def index(self, app_id):
+        return self.get(app_id).search()
+
+    def _build(self, app_id, version):
+        snapshot = InventorySnapshot(app_id, version)
+        for inventory in self.db_inventories.get_all_app_id(app_id):
+            self._apply(snapshot, inventory)
+        return snapshot
+
+    def _update(self, previous, version, changes):
+        snapshot = previous.copy(version)
+        for bot_key, changed_version in changes.items():
+            if int(changed_version) <= previous.version:
+                continue
+            if isinstance(bot_key, bytes):
+                bot_key = bot_key.decode("utf-8")
+            server_id, bot_username = bot_key.split("_", 1)
+            inventory = self.db_inventories.get(server_id, bot_username, snapshot.app_id)
+            if inventory:
+                self._apply(snapshot, inventory)
+            else:
+                snapshot.remove_bot(bot_key)
+        return snapshot
+
+    def stream(self, app_id):
+        yield '{"inventory": {'
+        empty = True
+        for inventory in self.db_inventories.iter_app_id(app_id, descriptions=False):
+            crypted_bot, crypted_server = self._crypt(inventory)
+            entries = []
+            for key, item in inventory["inventory"].items():
+                item["bot"] = crypted_bot
+                item["server"] = crypted_server
+                entries.append("%s: %s" % (json.dumps("%s_%s" % (key, crypted_bot)), json.dumps(item)))
+            if entries:
+                yield ("" if empty else ", ") + ", ".join(entries)
+                empty = False
+
+        yield '}, "descriptions": {'
+        streamed_keys = set()
+        for inventory in self.db_inventories.iter_app_id(app_id, assets=False):
+            entries = []
+            for key, description in inventory["descriptions"].items():
+                if key not in streamed_keys:
+                    entries.append("%s: %s" % (json.dumps(key), json.dumps(description)))
+                    streamed_keys.add(key)
+            if entries:
+                yield ("" if len(streamed_keys) == len(entries) else ", ") + ", ".join(entries)
+        yield '}, "empty": %s}' % json.dumps(empty)
+
+    def _crypt(self, inventory):
+        crypted_bot = self.token_codec.encode(inventory["bot"])
+        crypted_server = self.token_codec.encode(inventory["server_id"])
+        return crypted_bot, crypted_server
+
+    def _apply(self, snapshot, inventory):
+        bot_key = "%s_%s" % (inventory["server_id"], inventory["bot"])
+        crypted_bot, crypted_server = self._crypt(inventory)
+        snapshot.set_bot(bot_key, crypted_bot, crypted_server, inventory["inventory"], inventory["descriptions"])
@@ -0,0 +1,321 @@
+from bson.objectid import ObjectId
+import json
+
+
+class TradeError(Exception):
+    def __init__(self, status, payload=None):
+        super(TradeError, self).__init__(status)
+        self.status = status
+        self.payload = payload
+
+
+def parse_trade_request(form):
+    trade_token = form.get("trade_token")
+    report_url = form.get("report_url")
+
+    additional = form.get("data")
+    assets = form.get("assets")
+
+    if not trade_token or not report_url or not assets:
+        return None
+
+    try:
+        additional = json.loads(additional)
+        assets = json.loads(assets)
+    except (TypeError, ValueError):
+        return None
+
+    if not isinstance(additional, dict) or not isinstance(assets, list):
+        return None
+    if not storable_keys(additional):
+        return None
+
+    additional.pop("token", None)
+    return trade_token, report_url, additional, assets
+
+
+def storable_keys(value):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key.startswith("$") or "." in key or "\x00" in key:
+                return False
+            if not storable_keys(item):
+                return False
+    elif isinstance(value, list):
+        for item in value:
+            if not storable_keys(item):
+                return False
+    return True
+
+
+def withdrawal_asset_keys(assets):
+    return [(int(asset["app_id"]), str(asset["assetid"])) for asset in assets]
+
+
+def check_withdrawal_assets(assets, locations):
+    seen = set()
+    stale = []
+    duplicate = []
+    for asset, key in zip(assets, withdrawal_asset_keys(assets)):
+        if key in seen:
+            duplicate.append(asset["assetid"])
+        elif key not in locations:
+            stale.append(asset["assetid"])
+        seen.add(key)
+    return stale, duplicate
+
+
+def group_withdrawal_assets(assets, locations, token_codec):
+    groups = {}
+    for asset, key in zip(assets, withdrawal_asset_keys(assets)):
+        location = locations[key]
+        server_id = location["server_id"]
+        bot_username = location["bot"]
+        group = groups.get((server_id, bot_username))
+        if group is None:
+            group = groups[(server_id, bot_username)] = {
+                "server_id": server_id,
+                "bot_username": bot_username,
+                "bot": token_codec.encode(bot_username),
+                "server": token_codec.encode(server_id),
+                "assets": [],
+                "points": 0,
+                "reservations": []
+            }
+        group["reservations"].append((server_id, bot_username, key[0], key[1]))
+        asset.pop("bot", None)
+        asset.pop("server", None)
+        if location.get("points") is not None:
+            asset["points"] = location["points"]
+        group["assets"].append(asset)
+        group["points"] += int(asset["points"])
+    return [groups[key] for key in sorted(groups.keys())]
+
+
+def prepare_withdrawal(trade_request, db_asset_locations, asset_reservations, token_codec, max_assets=50):
+    if not trade_request:
+        raise TradeError(400)
+
+    trade_token, report_url, additional, assets = trade_request
+    if len(assets) == 0 or len(assets) > max_assets:
+        raise TradeError(400)
+
+    # TODO: Check settings restrictions
+
+    try:
+        locations = db_asset_locations.locate(withdrawal_asset_keys(assets))
+    except (KeyError, TypeError, ValueError):
+        raise TradeError(400)
+
+    stale_assets, duplicate_assets = check_withdrawal_assets(assets, locations)
+    if stale_assets or duplicate_assets:
+        raise TradeError(400, {"stale": stale_assets, "duplicate": duplicate_assets})
+
+    groups = group_withdrawal_assets(assets, locations, token_codec)
+    if not asset_reservations.reserve([reservation for group in groups for reservation in group["reservations"]]):
+        raise TradeError(400)
+
+    for group in groups:
+        group["additional"] = dict(additional, points=group["points"])
+    return {"trade_token": trade_token, "report_url": report_url, "additional": additional, "groups": groups}
+
+
+def withdrawal_jobs(steam_id, withdrawal, token, get_server):
+    db_servers_by_id = {}
+    jobs = []
+    for group in withdrawal["groups"]:
+        server_id = group["server_id"]
+        if server_id not in db_servers_by_id:
+            db_servers_by_id[server_id] = get_server(server_id)
+        jobs.append((server_id, steam_id, withdrawal["trade_token"], group["assets"], group["bot_username"], withdrawal["report_url"], group["additional"], token, db_servers_by_id[server_id]))
+    return jobs
+
+
+def record_withdrawals(steam_id, withdrawal, results, db_withdrawals, asset_reservations):
+    new_withdrawals = []
+    failures = []
+    released = []
+
+    for group, result in zip(withdrawal["groups"], results):
+        if result.get("success", False):
+            new_withdrawals.append({
+                "server_id": group["server_id"],
+                "steam_id": steam_id,
+                "trade_token": withdrawal["trade_token"],
+                "assets": group["assets"],
+                "report_url": withdrawal["report_url"],
+                "security_code": result["security_code"],
+                "celery_task_id": result["task_id"],
+                "bot": result["bot"],
+                "bot_username": group["bot_username"],
+                "additional": group["additional"]
+            })
+        else:
+            released.extend(group["reservations"])
+            failures.append(failed_withdrawal(group))
+
+    if released:
+        asset_reservations.release(released)
+    withdrawals = []
+    if db_withdrawals.add_many(new_withdrawals):
+        withdrawals = [trade_result(new_withdrawal) for new_withdrawal in new_withdrawals]
+
+    data = dict(withdrawal["additional"], points=sum(group["points"] for group in withdrawal["groups"]))
+    return {"withdrawals": withdrawals, "failed": failures, "data": data}
+
+
+def failed_withdrawal(group):
+    return {
+        "bot": group["bot"],
+        "server": group["server"],
+        "assets": [asset["assetid"] for asset in group["assets"]]
+    }
+
+
+def plan_deposit(assets, servers, max_load=0.9, max_assets=50):
+    candidates = []
+    for server_id, load, bots in servers:
+        if load <= max_load and bots > 0:
+            candidates.append({"server_id": server_id, "weight": (1.0 - load) * bots, "slots": bots, "parts": 0})
+    if not candidates:
+        return None
+
+    part_count = (len(assets) + max_assets - 1) // max_assets
+    for _ in range(part_count):
+        available = [candidate for candidate in candidates if candidate["parts"] < candidate["slots"]]
+        if not available:
+            return None
+        best = max(available, key=lambda candidate: candidate["weight"] / (candidate["parts"] + 1))
+        best["parts"] += 1
+
+    parts = []
+    start = 0
+    for index, candidate in enumerate(server for server in candidates for _ in range(server["parts"])):
+        size = len(assets) // part_count + (1 if index < len(assets) % part_count else 0)
+        parts.append({"server_id": candidate["server_id"], "assets": assets[start:start + size]})
+        start += size
+    return parts
+
+
+def prepare_deposit(trade_request, server_loads, max_assets=500, max_load=0.9, max_assets_per_trade=50):
+    if not trade_request:
+        raise TradeError(400)
+
+    trade_token, report_url, additional, assets = trade_request
+    if len(assets) == 0 or len(assets) > max_assets:
+        raise TradeError(400)
+
+    # TODO: Check settings restrictions
+
+    parts = plan_deposit(assets, server_loads.ranked(), max_load, max_assets_per_trade)
+    if not parts:
+        raise TradeError(503)
+    return {"trade_token": trade_token, "report_url": report_url, "additional": additional, "parts": parts, "group_id": str(ObjectId())}
+
+
+def deposit_jobs(steam_id, deposit, token, get_server):
+    db_servers_by_id = {}
+    jobs = []
+    for part in deposit["parts"]:
+        server_id = part["server_id"]
+        if server_id not in db_servers_by_id:
+            db_servers_by_id[server_id] = get_server(server_id)
+        jobs.append((server_id, steam_id, deposit["trade_token"], part["assets"], deposit["report_url"], deposit["additional"], token, db_servers_by_id[server_id]))
+    return jobs
+
+
+def record_deposits(steam_id, deposit, results, db_deposits):
+    new_deposits = []
+    failures = []
+
+    for part, result in zip(deposit["parts"], results):
+        if result.get("success", False):
+            new_deposits.append({
+                "server_id": part["server_id"],
+                "steam_id": steam_id,
+                "trade_token": deposit["trade_token"],
+                "assets": part["assets"],
+                "report_url": deposit["report_url"],
+                "security_code": result["security_code"],
+                "celery_task_id": result["task_id"],
+                "bot": result["bot"],
+                "additional": deposit["additional"],
+                "group_id": deposit["group_id"]
+            })
+        else:
+            failures.append(failed_deposit(part))
+
+    if not new_deposits or not db_deposits.add_many(new_deposits):
+        raise TradeError(500)
+
+    deposits = [trade_result(new_deposit) for new_deposit in new_deposits]
+    return {
+        "security_code": deposits[0]["security_code"],
+        "data": {"bot": deposits[0]["bot"]},
+        "deposits": deposits,
+        "failed": failures,
+        "group_id": deposit["group_id"]
+    }
+
+
+def failed_deposit(part):
+    return {
+        "assets": [asset.get("assetid") if isinstance(asset, dict) else asset for asset in part["assets"]]
+    }
+
+
+def trade_result(trade):
+    return {"security_code": trade["security_code"], "task_id": trade["celery_task_id"], "bot": trade["bot"]}
+
+
+def trade_report_update(report):
+    fields = {"status": int(report.get("status"))}
+    data = {}
+
+    if report.get("tradeoffer_id"):
+        data["tradeoffer_id"] = report.get("tradeoffer_id")
+
+    if report.get("celery_task_id"):
+        fields["celery_task_id"] = report.get("celery_task_id")
+
+    if report.get("error"):
+        fields["message"] = report.get("error")
+    return fields, data
+
+
+def deposit_report_updates(reports):
+    if not isinstance(reports, list) or not all(isinstance(report, dict) for report in reports):
+        raise ValueError("Reports must be a list of objects")
+    updates = []
+    for report in reports:
+        fields, data = trade_report_update(report)
+        update = {"steam_id": str(report["steam_id"]), "fields": fields, "data": data}
+        if report.get("security_code"):
+            update["security_code"] = str(report["security_code"])
+        updates.append(update)
+    return updates
+
+
+def update_deposit_reports(updates, db_deposits):
+    updated = set(db_deposits.update_last_many(updates))
+    missing = []
+    for update in updates:
+        if (update["steam_id"], update.get("security_code")) not in updated:
+            missing.append(dict((key, update[key]) for key in ("steam_id", "security_code") if key in update))
+    return {"updated": len(updated), "missing": missing}
+
+
+def withdrawal_report_updates(reports):
+    if not isinstance(reports, list) or not all(isinstance(report, dict) for report in reports):
+        raise ValueError("Reports must be a list of objects")
+    updates = []
+    for report in reports:
+        fields, data = trade_report_update(report)
+        updates.append({"steam_id": str(report["steam_id"]), "bot_username": report["bot"], "fields": fields, "data": data})
+    return updates
+
+
+def update_withdrawal_reports(updates, db_withdrawals):
+    updated = set(db_withdrawals.update_last_many(updates))
+    missing = [{"steam_id": update["steam_id"], "bot": update["bot_username"]} for update in updates if (update["steam_id"], update["bot_username"]) not in updated]
+    return {"updated": len(updated), "missing": missing}
@@ -0,0 +1,117 @@
+from requests.adapters import HTTPAdapter
+import requests
+import threading
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUTS = {
+    "ping": (3, 20),
+    "stats": (3, 5),
+    "deposit": (3, 20),
+    "withdraw": (3, 20),
+    "inventory": (3, 300),
+    "add_bot": (3, 120),
+    "toggle_bot": (3, 20),
+    "remove_bot": (3, 20)
+}
+
+
+class CircuitOpenError(requests.RequestException):
+    pass
+
+
+UPSTREAM_ERRORS = (requests.RequestException, ValueError, KeyError)
+
+
+class UpstreamClient():
+    def __init__(self, timeouts=None, retries=2, backoff=0.2, failure_threshold=5, reset_timeout=30, pool_size=10, metrics=None):
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        for operation, timeout in (timeouts or {}).items():
+            self.timeouts[operation] = tuple(timeout) if isinstance(timeout, (list, tuple)) else timeout
+        self.retries = int(retries)
+        self.backoff = float(backoff)
+        self.failure_threshold = int(failure_threshold)
+        self.reset_timeout = float(reset_timeout)
+        self.pool_size = int(pool_size)
+        self.metrics = metrics
+        self.sessions = {}
+        self.circuits = {}
+        self.lock = threading.Lock()
+
+    def get(self, operation, host, port, path, params=None):
+        return self.request(operation, "GET", host, port, path, params=params)
+
+    def post(self, operation, host, port, path, data=None):
+        return self.request(operation, "POST", host, port, path, data=data)
+
+    def request(self, operation, method, host, port, path, params=None, data=None):
+        if self.metrics is None:
+            return self.send(operation, method, host, port, path, params, data)
+        with self.metrics.span("upstream", operation):
+            return self.send(operation, method, host, port, path, params, data)
+
+    def send(self, operation, method, host, port, path, params=None, data=None):
+        server_key = "%s:%s" % (str(host), int(port))
+        if not self.allow(server_key):
+            raise CircuitOpenError("Circuit open for %s" % server_key)
+
+        url = "http://%s%s" % (server_key, path)
+        attempts = 1 + (self.retries if method == "GET" else 0)
+        for attempt in range(attempts):
+            try:
+                response = self.session(server_key).request(method, url, params=params, data=data, timeout=self.timeouts[operation])
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.record_failure(server_key)
+                if attempt + 1 >= attempts:
+                    raise
+                logger.warning("%s %s failed (attempt %s/%s): %s", method, url, attempt + 1, attempts, e)
+                time.sleep(self.backoff * (2 ** attempt))
+                continue
+
+            if response.status_code >= 500:
+                self.record_failure(server_key)
+                if attempt + 1 < attempts:
+                    logger.warning("%s %s returned %s (attempt %s/%s)", method, url, response.status_code, attempt + 1, attempts)
+                    time.sleep(self.backoff * (2 ** attempt))
+                    continue
+            else:
+                self.record_success(server_key)
+            return response
+
+    def session(self, server_key):
+        session = self.sessions.get(server_key)
+        if session is None:
+            with self.lock:
+                session = self.sessions.get(server_key)
+                if session is None:
+                    session = requests.Session()
+                    session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size))
+                    self.sessions[server_key] = session
+        return session
+
+    def allow(self, server_key):
+        with self.lock:
+            circuit = self.circuits.get(server_key)
+            if not circuit or circuit["failures"] < self.failure_threshold:
+                return True
+            now = time.time()
+            if now >= circuit["open_until"]:
+                circuit["open_until"] = now + self.reset_timeout
+                return True
+            return False
+
+    def record_failure(self, server_key):
+        with self.lock:
+            circuit = self.circuits.setdefault(server_key, {"failures": 0, "open_until": 0})
+            circuit["failures"] += 1
+            if circuit["failures"] >= self.failure_threshold:
+                if circuit["failures"] == self.failure_threshold:
+                    logger.error("Opening circuit for %s after %s failures", server_key, circuit["failures"])
+                circuit["open_until"] = time.time() + self.reset_timeout
+
+    def record_success(self, server_key):
+        with self.lock:
+            self.circuits.pop(server_key, None)
@@ -1,13 +1,160 @@
 from bson.objectid import ObjectId
+from pymongo import UpdateOne, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from collections import OrderedDict
 import json
 
 
 class DatabaseWithdrawals():
-    def __init__(self, db):
+    indexes = [
+        {"keys": [("steam_id", ASCENDING), ("status", ASCENDING)]},
+        {"keys": [("steam_id", ASCENDING), ("bot_username", ASCENDING), ("_id", DESCENDING)]},
+        {"keys": [("status", ASCENDING), ("_id", ASCENDING)]}
+    ]
+
+    def __init__(self, db, cache=None):
         self.collection = db["withdrawals"]
+        self.cache = cache
+
+    def query_shapes(self):
+        return [
+            {"filter": {"status": {"$lt": 3}}},
+            {"filter": {"status": {"$in": [0, 1, 2]}}, "sort": [("_id", ASCENDING)]},
+            {"filter": {"status": {"$in": [0, 1, 2]}, "_id": {"$gt": ObjectId()}}, "sort": [("_id", ASCENDING)]},
+            {"filter": {"steam_id": "0", "status": {"$lt": 3}}},
+            {"filter": {"steam_id": "0", "status": {"$gte": 3}}},
+            {"filter": {"steam_id": "0", "bot_username": "bot"}, "sort": [("_id", DESCENDING)]},
+            {"filter": {"steam_id": {"$in": ["0", "1"]}, "bot_username": {"$in": ["bot"]}}, "sort": [("_id", DESCENDING)]}
+        ]
 
     def add(self, server_id, steam_id, trade_token, assets, report_url, security_code, celery_task_id, bot, bot_username, additional):
-        new_deposit = {
+        result = self.collection.insert_one(self._new_withdrawal(server_id, steam_id, trade_token, assets, report_url, security_code, celery_task_id, bot, bot_username, additional))
+        self._invalidate([steam_id])
+        return result.inserted_id is not None
+
+    def add_many(self, withdrawals):
+        if not withdrawals:
+            return True
+        result = self.collection.insert_many([self._new_withdrawal(**withdrawal) for withdrawal in withdrawals], ordered=False)
+        self._invalidate(list(set(withdrawal["steam_id"] for withdrawal in withdrawals)))
+        return len(result.inserted_ids) == len(withdrawals)
+
+    def get(self, withdrawal_id):
+        return self._serialize(self.collection.find_one({"_id": ObjectId(withdrawal_id)}, {"_id": 0}))
+
+    def get_processing(self):
+        return [self._serialize(withdrawal) for withdrawal in self.collection.find({"status": {"$lt": 3}}, {"_id": 0})]
+
+    def get_processing_page(self, after=None, limit=50):
+        query = {"status": {"$in": self.collection.distinct("status", {"status": {"$lt": 3}})}}
+        if after:
+            query["_id"] = {"$gt": ObjectId(after)}
+        withdrawals = list(self.collection.find(query, {"server_id": 1, "steam_id": 1, "trade_token": 1, "assets": 1, "security_code": 1, "bot": 1, "bot_username": 1, "data": 1, "celery_task_id": 1, "status": 1}).sort("_id", ASCENDING).limit(limit + 1))
+        next_cursor = None
+        if len(withdrawals) > limit:
+            withdrawals = withdrawals[:limit]
+            next_cursor = str(withdrawals[-1]["_id"])
+        for withdrawal in withdrawals:
+            withdrawal.pop("_id")
+            self._serialize(withdrawal)
+        return withdrawals, next_cursor
+
+    def count_processing(self):
+        counts = self.collection.aggregate([
+            {"$match": {"status": {"$lt": 3}}},
+            {"$group": {"_id": {"status": "$status", "server_id": "$server_id", "bot": "$bot_username"}, "count": {"$sum": 1}}},
+            {"$sort": {"_id.status": 1, "_id.server_id": 1, "_id.bot": 1}}
+        ])
+        return [dict(count["_id"], count=count["count"]) for count in counts]
+
+    def get_steam_id(self, steam_id, active=True):
+        if active:
+            if self.cache:
+                return self.cache.get(steam_id, lambda: self._get_steam_id_active(steam_id))
+            return self._get_steam_id_active(steam_id)
+        return [self._serialize(withdrawal) for withdrawal in self.collection.find({"steam_id": steam_id, "status": {"$gte": 3}}, {"_id": 0})]
+
+    def set_data(self, steam_id, bot_username, key, value):
+        return self.update_last(steam_id, bot_username, data={key: value})
+
+    def change_status_last(self, steam_id, bot_username, status):
+        return self.update_last(steam_id, bot_username, {"status": int(status)})
+
+    def change_celery_task_id_last(self, steam_id, bot_username, celery_task_id):
+        return self.update_last(steam_id, bot_username, {"celery_task_id": celery_task_id})
+
+    def change_message_last(self, steam_id, bot_username, message):
+        return self.update_last(steam_id, bot_username, {"message": message})
+
+    def update_last(self, steam_id, bot_username, fields=None, data=None):
+        update_fields = dict(fields or {})
+        for key, value in (data or {}).items():
+            update_fields["data.%s" % key] = value
+        try:
+            last_withdrawal = self.collection.find_one_and_update(
+                {"steam_id": steam_id, "bot_username": bot_username},
+                {"$set": update_fields},
+                sort=[("_id", -1)],
+                projection={"_id": 1}
+            )
+            if last_withdrawal is None:
+                return False
+        except OperationFailure:
+            last_withdrawal = self.collection.find_one({"steam_id": steam_id, "bot_username": bot_username}, sort=[("_id", -1)])
+            update_fields = dict(fields or {})
+            update_fields["data"] = self._merge_data(last_withdrawal["data"], data)
+            result = self.collection.update_one({"_id": last_withdrawal["_id"]}, {"$set": update_fields})
+            if not result.acknowledged:
+                return False
+        self._invalidate([steam_id])
+        return True
+
+    def update_last_many(self, reports):
+        updates = OrderedDict()
+        for report in reports:
+            update = updates.setdefault((report["steam_id"], report["bot_username"]), ({}, {}))
+            update[0].update(report.get("fields") or {})
+            update[1].update(report.get("data") or {})
+        if not updates:
+            return []
+
+        last_withdrawals = self.collection.aggregate([
+            {"$match": {
+                "steam_id": {"$in": list(set(key[0] for key in updates))},
+                "bot_username": {"$in": list(set(key[1] for key in updates))}
+            }},
+            {"$sort": {"_id": -1}},
+            {"$group": {
+                "_id": {"steam_id": "$steam_id", "bot_username": "$bot_username"},
+                "last_id": {"$first": "$_id"},
+                "data": {"$first": "$data"}
+            }}
+        ])
+
+        operations = []
+        updated = []
+        for last_withdrawal in last_withdrawals:
+            key = (last_withdrawal["_id"]["steam_id"], last_withdrawal["_id"]["bot_username"])
+            if key not in updates:
+                continue
+            fields, data = updates[key]
+            update_fields = dict(fields)
+            if isinstance(last_withdrawal["data"], dict):
+                for data_key, value in data.items():
+                    update_fields["data.%s" % data_key] = value
+            elif data:
+                update_fields["data"] = self._merge_data(last_withdrawal["data"], data)
+            if update_fields:
+                operations.append(UpdateOne({"_id": last_withdrawal["last_id"]}, {"$set": update_fields}))
+            updated.append(key)
+
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+        self._invalidate([key[0] for key in updated])
+        return updated
+
+    def _new_withdrawal(self, server_id, steam_id, trade_token, assets, report_url, security_code, celery_task_id, bot, bot_username, additional):
+        new_withdrawal = {
             "server_id": server_id,
             "steam_id": steam_id,
             "trade_token": trade_token,
@@ -16,43 +163,27 @@ class DatabaseWithdrawals():
             "security_code": security_code,
             "bot": bot,
             "bot_username": bot_username,
-            "data": json.dumps(additional),
+            "data": additional,
             "celery_task_id": celery_task_id,
             "message": None,
             "status": 0
         }
-        result = self.collection.insert(new_deposit)
-        return result is not None
-
-    def get(self, withdrawal_id):
-        return self.collection.find_one({"_id": ObjectId(withdrawal_id)}, {"_id": 0})
+        return new_withdrawal
 
-    def get_processing(self):
-        return list(self.collection.find({"status": {"$lt": 3}}, {"_id": 0}))
+    def _merge_data(self, last_data, data):
+        if not isinstance(last_data, dict):
+            last_data = json.loads(last_data)
+        last_data.update(data or {})
+        return last_data
 
-    def get_steam_id(self, steam_id, active=True):
-        if active:
-            return list(self.collection.find({"steam_id": steam_id, "status": {"$lt": 3}}, {"_id": 0}))
-        return list(self.collection.find({"steam_id": steam_id, "status": {"$gte": 3}}, {"_id": 0}))
+    def _get_steam_id_active(self, steam_id):
+        return [self._serialize(withdrawal) for withdrawal in self.collection.find({"steam_id": steam_id, "status": {"$lt": 3}}, {"_id": 0})]
 
-    def set_data(self, steam_id, bot_username, key, value):
-        last_withdrawal = list(self.collection.find({"steam_id": steam_id, "bot_username": bot_username}).limit(1).sort("_id", -1))[0]
-        last_data = json.loads(last_withdrawal["data"])
-        last_data[key] = value
-        result = self.collection.update({"_id": last_withdrawal["_id"]}, {"$set": {"data": json.dumps(last_data)}})
-        return result['ok'] == 1
+    def _invalidate(self, steam_ids):
+        if self.cache and steam_ids:
+            self.cache.invalidate(steam_ids)
 
-    def change_status_last(self, steam_id, bot_username, status):
-        last_withdrawal = list(self.collection.find({"steam_id": steam_id, "bot_username": bot_username}).limit(1).sort("_id", -1))[0]
-        result = self.collection.update({"_id": last_withdrawal["_id"]}, {"$set": {"status": int(status)}})
-        return result['ok'] == 1
-
-    def change_celery_task_id_last(self, steam_id, bot_username, celery_task_id):
-        last_withdrawal = list(self.collection.find({"steam_id": steam_id, "bot_username": bot_username}).limit(1).sort("_id", -1))[0]
-        result = self.collection.update({"_id": last_withdrawal["_id"]}, {"$set": {"celery_task_id": celery_task_id}})
-        return result['ok'] == 1
-
-    def change_message_last(self, steam_id, bot_username, message):
-        last_withdrawal = list(self.collection.find({"steam_id": steam_id, "bot_username": bot_username}).limit(1).sort("_id", -1))[0]
-        result = self.collection.update({"_id": last_withdrawal["_id"]}, {"$set": {"message": message}})
-        return result['ok'] == 1
\ No newline at end of file
+    def _serialize(self, withdrawal):
+        if withdrawal and isinstance(withdrawal.get("data"), dict):
+            withdrawal["data"] = json.dumps(withdrawal["data"])
+        return withdrawal